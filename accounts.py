@@ -0,0 +1,56 @@
+import logging
+
+import argparse
+
+from haruhichanbot.config import Config
+from haruhichanbot.commands_config import CommandsConfig
+from haruhichanbot import db_manager
+from haruhichanbot import bulk_accounts
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Import or export the accounts of HaruhiChanBot")
+    parser.add_argument("action", choices=("import", "export"))
+    parser.add_argument("file",
+                        help="accounts file (.csv, .json or .jsonl)")
+    parser.add_argument("--config", dest="cfg_file",
+                        default=None,
+                        help="path to the configuration file to use")
+    parser.add_argument("--commands-config", dest="cmd_cfg_file",
+                        default=None,
+                        help="path to the commands settings file to use")
+    parser.add_argument("--guild", type=int, default=None,
+                        help="Discord server ID the accounts are imported " +
+                        "in, instead of the discord_guild_id of each row")
+    parser.add_argument("--batch-size", type=int, default=1000,
+                        help="number of accounts per database transaction")
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    file_format = bulk_accounts.get_file_format(args.file)
+    db_manager.init_session(Config(args.cfg_file))
+
+    if args.action == "import":
+        with open(args.file, "r", encoding="utf-8-sig", newline="") as f:
+            nb_read, nb_inserted, errors = bulk_accounts.import_accounts(
+                f, file_format, CommandsConfig(args.cmd_cfg_file),
+                args.guild, args.batch_size)
+        for error in errors:
+            print(error)
+        print(f"{nb_inserted} account(s) imported, " +
+              f"{nb_read - nb_inserted} already registered, " +
+              f"{len(errors)} invalid row(s).")
+    else:
+        with open(args.file, "w", encoding="utf-8", newline="") as f:
+            nb_accounts = bulk_accounts.export_accounts(f, file_format,
+                                                        args.batch_size)
+        print(f"{nb_accounts} account(s) exported.")
+
+
+if __name__ == '__main__':
+    main()
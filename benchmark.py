@@ -0,0 +1,533 @@
+import asyncio
+import inspect
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import argparse
+
+from haruhichanbot import HaruhiChanBot
+from haruhichanbot import db_manager
+
+SOURCES = {
+    "AzurLane": {"aliases": ["al"], "servers": ["Sandy", "Avrora", "Lynx"]},
+    "Osu": {"aliases": None, "servers": None},
+}
+ROLES = {f"role{i}": {"id": 1000 + i, "title": f"Role {i}",
+                      "description": f"Benchmark role {i}"}
+         for i in range(5)}
+
+# Command name -> (weight in the mix, function building the arguments)
+COMMAND_MIX = {
+    "help": (20, lambda rng: ""),
+    "register_account": (25, lambda rng: "al {0} name{1}".format(
+        rng.choice(SOURCES["AzurLane"]["servers"]), rng.randrange(10**6))),
+    "list_self_accounts": (15, lambda rng: ""),
+    "list_accounts": (15, lambda rng: "al {0}".format(
+        rng.choice(SOURCES["AzurLane"]["servers"]))),
+    "add_role": (10, lambda rng: rng.choice(list(ROLES))),
+    "remove_role": (10, lambda rng: rng.choice(list(ROLES))),
+    "random": (5, lambda rng: "1 100"),
+}
+
+CONFIG_TEMPLATE = """
+[Credentials]
+BotToken = benchmark
+SqlDbApi = sqlite
+SqlDatabase = {database}
+
+[Chat]
+CommandPrefix = !
+
+[Cache]
+MemberSnapshotFile =
+
+[RateLimit]
+UserRate = 0
+ChannelRate = 0
+CommandRate = 0
+
+[SendQueue]
+Rate = 1000000
+Burst = 1000000
+"""
+
+
+# Stand-ins for the discord.py objects used by the commands
+
+class FakePermissions():
+    administrator = False
+
+
+class FakeRole():
+    def __init__(self, role_id, guild):
+        self.id = role_id
+        self.guild = guild
+
+
+class FakeUser():
+    def __init__(self, user_id, guild=None):
+        self.id = user_id
+        self.guild = guild
+        self.roles = list()
+        self.guild_permissions = FakePermissions()
+
+    def __str__(self):
+        return f"user{self.id}#0001"
+
+    async def add_roles(self, *roles, atomic=True):
+        await asyncio.sleep(Fakes.rest_latency)
+        self.roles.extend(role for role in roles if role not in self.roles)
+
+    async def remove_roles(self, *roles, atomic=True):
+        await asyncio.sleep(Fakes.rest_latency)
+        self.roles = [role for role in self.roles if role not in roles]
+
+
+class FakeGuild():
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self._roles = {desc["id"]: FakeRole(desc["id"], self)
+                       for desc in ROLES.values()}
+
+    def get_role(self, role_id):
+        return self._roles.get(role_id)
+
+    def get_member(self, user_id):
+        return None
+
+
+class FakeChannel():
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.nb_sent = 0
+
+    async def send(self, content):
+        await asyncio.sleep(Fakes.rest_latency)
+        self.nb_sent += 1
+
+
+class FakeMessage():
+    def __init__(self, content, author, channel, guild):
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = guild
+        self.attachments = list()
+
+
+class Fakes():
+    """Simulated Discord state shared by a benchmark run"""
+    rest_latency = 0.05
+    nb_rest_calls = 0
+
+
+def build_bot(tmp_dir, rest_latency):
+    """Returns a HaruhiChanBot on a SQLite database, with faked REST calls"""
+    config_file = os.path.join(tmp_dir, "config.ini")
+    with open(config_file, "w") as f:
+        f.write(CONFIG_TEMPLATE.format(
+            database=os.path.join(tmp_dir, "benchmark.db")))
+    cmd_cfg_file = os.path.join(tmp_dir, "commands_settings.json")
+    with open(cmd_cfg_file, "w") as f:
+        json.dump({"account_sources": SOURCES, "roles": ROLES}, f)
+
+    Fakes.rest_latency = rest_latency
+    bot = HaruhiChanBot(config_file, cmd_cfg_file)
+    db_manager.migrate()
+
+    async def wait_until_ready():
+        pass
+
+    async def fetch_user(user_id):
+        Fakes.nb_rest_calls += 1
+        await asyncio.sleep(Fakes.rest_latency)
+        return FakeUser(user_id)
+
+    bot.wait_until_ready = wait_until_ready
+    bot.fetch_user = fetch_user
+    bot.get_user = lambda user_id: None
+    return bot
+
+
+def build_messages(nb_messages, nb_users, nb_channels, seed):
+    """Returns (command name, message) pairs following COMMAND_MIX"""
+    rng = random.Random(seed)
+    guild = FakeGuild(1)
+    users = [FakeUser(10**17 + i, guild) for i in range(nb_users)]
+    channels = [FakeChannel(i) for i in range(nb_channels)]
+    names = list(COMMAND_MIX)
+    weights = [COMMAND_MIX[name][0] for name in names]
+
+    messages = list()
+    for name in rng.choices(names, weights, k=nb_messages):
+        content = "!{0} {1}".format(name, COMMAND_MIX[name][1](rng))
+        messages.append((name, FakeMessage(content.strip(), rng.choice(users),
+                                           rng.choice(channels), guild)))
+    return messages
+
+
+async def seed_accounts(nb_accounts, nb_users):
+    """Fills the database with nb_accounts random accounts"""
+    rng = random.Random(0)
+    servers = [s.lower() for s in SOURCES["AzurLane"]["servers"]]
+    accounts = [dict(discord_guild_id="1",
+                     discord_user_id=str(10**17 + rng.randrange(nb_users)),
+                     account_source="AzurLane",
+                     account_server=rng.choice(servers),
+                     account_name=f"seed{i}", comment=None)
+                for i in range(nb_accounts)]
+    for start in range(0, nb_accounts, 1000):
+        await asyncio.get_event_loop().run_in_executor(
+            None, db_manager.bulk_insert_user_accounts,
+            accounts[start:start + 1000])
+
+
+async def run_command(bot, message):
+    """Dispatches message to bot and waits until its command is done"""
+    task = bot.dispatch_command(message)
+    if task is not None:
+        await task
+
+
+async def run_load(bot, messages, concurrency):
+    """
+    Drives on_message with messages, concurrency at a time
+    Returns the latencies by command name and the total duration
+    """
+    latencies = {name: list() for name in COMMAND_MIX}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def dispatch(name, message):
+        async with semaphore:
+            start = time.perf_counter()
+            await run_command(bot, message)
+            latencies[name].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(dispatch(name, message)
+                           for name, message in messages))
+    duration = time.perf_counter() - start
+    while bot.send_queue.depth:
+        await asyncio.sleep(0.01)
+    return latencies, duration
+
+
+async def measure_allocations(bot, messages_by_command, nb_runs):
+    """
+    Returns the average peak of memory allocated during a call
+    of each command, in KiB
+    """
+    allocations = dict()
+    tracemalloc.start()
+    for name, messages in messages_by_command.items():
+        peaks = list()
+        for message in messages[:nb_runs]:
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            await run_command(bot, message)
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+        allocations[name] = {"alloc_kib": statistics.mean(peaks) / 1024}
+    tracemalloc.stop()
+    return allocations
+
+
+def parse_command(bot, message):
+    command, *args = message.content.strip().split()
+    return command[len(bot.config.command_prefix):].lower(), args
+
+
+def legacy_bind(bot, message):
+    """
+    Dispatch as done before the command registry: the handler is looked
+    up and its signature inspected for each message
+    """
+    command, args = parse_command(bot, message)
+    handler = getattr(bot, "cmd_" + command)
+    params = inspect.signature(handler).parameters.copy()
+    handler_kwargs = {}
+    if params.pop('user_id', None):
+        handler_kwargs['user_id'] = message.author.id
+    if params.pop('user', None):
+        handler_kwargs['user'] = message.author
+    if params.pop('cmd_args', None):
+        handler_kwargs['cmd_args'] = args
+    return handler, handler_kwargs
+
+
+def registry_bind(bot, message):
+    """Dispatch through the command registry"""
+    command, args = parse_command(bot, message)
+    cmd = bot.commands.get(command)
+    return cmd.handler, cmd.bind(message, args)
+
+
+def measure_dispatch(bot, messages, nb_repeats=5):
+    """
+    Returns the mean time to find the handler of a message and bind its
+    arguments, in microseconds, through the registry and the legacy path
+    The best of nb_repeats runs over messages is kept for each
+    """
+    messages = [message for name, message in messages]
+    results = dict()
+    for name, bind in (("legacy", legacy_bind), ("registry", registry_bind)):
+        durations = list()
+        for _ in range(nb_repeats):
+            start = time.perf_counter()
+            for message in messages:
+                bind(bot, message)
+            durations.append(time.perf_counter() - start)
+        results[f"{name}_us"] = min(durations) / len(messages) * 10**6
+    results["speedup"] = results["legacy_us"] / results["registry_us"]
+    return {"dispatch": results}
+
+
+def measure_index_queries(nb_queries, nb_users, seed):
+    """
+    Returns the mean time of the account queries in milliseconds,
+    with the indexes of UserAccounts and after dropping them
+    The accounts cache is disabled so that every call reaches the database
+    """
+    rng = random.Random(seed)
+    user_ids = [str(10**17 + rng.randrange(nb_users))
+                for _ in range(nb_queries)]
+    servers = [rng.choice(SOURCES["AzurLane"]["servers"]).lower()
+               for _ in range(nb_queries)]
+    queries = {
+        "get_accounts_for_user": lambda i, phase:
+            db_manager.get_accounts_for_user("1", user_ids[i]),
+        "get_accounts_for_source_and_server": lambda i, phase:
+            db_manager.get_accounts_for_source_and_server(
+                discord_guild_id="1", account_source="AzurLane",
+                account_server=servers[i], offset=50, limit=50),
+        "count_accounts_for_source_and_server": lambda i, phase:
+            db_manager.count_accounts_for_source_and_server(
+                discord_guild_id="1", account_source="AzurLane",
+                account_server=servers[i]),
+        # Duplicates are rejected by the unique index
+        "insert_user_account": lambda i, phase:
+            db_manager.insert_user_account(
+                discord_guild_id="1", discord_user_id=user_ids[i],
+                account_source="Osu", account_name=f"{phase}{i}"),
+    }
+
+    accounts_cache, db_manager.accounts_cache = db_manager.accounts_cache, None
+    results = {name: dict() for name in queries}
+    for phase in ("indexed", "unindexed"):
+        if phase == "unindexed":
+            for index in db_manager.UserAccounts.__table__.indexes:
+                index.drop(db_manager.engine)
+        for name, query in queries.items():
+            start = time.perf_counter()
+            for i in range(nb_queries):
+                query(i, phase)
+            results[name][f"{phase}_ms"] = (
+                (time.perf_counter() - start) / nb_queries * 1000)
+    for stats in results.values():
+        stats["speedup"] = stats["unindexed_ms"] / stats["indexed_ms"]
+    db_manager.accounts_cache = accounts_cache
+    return results
+
+
+async def measure_user_names(bot, nb_users):
+    """
+    Returns the fetch_user calls and the time taken to name the users
+    of a listing, fetching them one at a time as before the users cache,
+    then through get_user_names with an empty and a filled cache
+    Half of the users are in the gateway cache, as members seen by the bot
+    """
+    user_ids = [10**17 + i for i in range(nb_users)]
+    get_user = bot.get_user
+    bot.get_user = lambda user_id: FakeUser(user_id) if user_id % 2 else None
+
+    async def fetch_sequentially(guild, user_ids):
+        user_names = dict()
+        for user_id in user_ids:
+            if user_id not in user_names:
+                user_names[user_id] = str(await bot.fetch_user(user_id))
+        return user_names
+
+    results = dict()
+    for name, get_user_names in (("sequential", fetch_sequentially),
+                                 ("cold_cache", bot.get_user_names),
+                                 ("warm_cache", bot.get_user_names)):
+        nb_rest_calls = Fakes.nb_rest_calls
+        start = time.perf_counter()
+        user_names = await get_user_names(FakeGuild(1), user_ids)
+        assert len(user_names) == nb_users
+        results[name] = {
+            "duration_ms": (time.perf_counter() - start) * 1000,
+            "rest_calls": Fakes.nb_rest_calls - nb_rest_calls}
+    bot.get_user = get_user
+    return results
+
+
+def percentile(values, ratio):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(ratio * len(values)))]
+
+
+def summarize(latencies, duration, allocations):
+    results = dict()
+    for name, values in latencies.items():
+        if not values:
+            continue
+        results[name] = {
+            "count": len(values),
+            "p50_ms": percentile(values, 0.5) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+            "mean_ms": statistics.mean(values) * 1000,
+            **allocations.get(name, {})}
+    nb_commands = sum(len(values) for values in latencies.values())
+    return {"commands": results,
+            "total": {"count": nb_commands,
+                      "duration_s": duration,
+                      "throughput_per_s": nb_commands / duration,
+                      "rest_calls": Fakes.nb_rest_calls}}
+
+
+def get_git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_measurements(results):
+    """Prints the results of a scenario other than load"""
+    for name, stats in results.items():
+        if name == "run":
+            continue
+        print(name + ": " + ", ".join(
+            "{0} {1:.3f}".format(key, value) if isinstance(value, float)
+            else f"{key} {value}" for key, value in stats.items()))
+
+
+def print_results(results, previous=None):
+    print("{:<20} {:>7} {:>10} {:>10} {:>10} {:>10}".format(
+        "command", "count", "p50 ms", "p99 ms", "KiB/call", "p50 delta"))
+    for name, stats in results["commands"].items():
+        delta = ""
+        if previous and name in previous["commands"]:
+            old_p50 = previous["commands"][name]["p50_ms"]
+            delta = "{:+.1f}%".format(
+                (stats["p50_ms"] - old_p50) / old_p50 * 100)
+        print("{:<20} {:>7} {:>10.2f} {:>10.2f} {:>10} {:>10}".format(
+            name, stats["count"], stats["p50_ms"], stats["p99_ms"],
+            "{:.1f}".format(stats["alloc_kib"]) if "alloc_kib" in stats
+            else "-", delta))
+    total = results["total"]
+    print("{count} commands in {duration_s:.2f}s: ".format(**total) +
+          "{throughput_per_s:.1f} commands/s, ".format(**total) +
+          "{rest_calls} fetch_user calls".format(**total))
+
+
+SCENARIOS = ("load", "dispatch", "indexes", "user_names")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Replays a mix of commands on HaruhiChanBot " +
+        "with a fake Discord gateway and a SQLite database")
+    parser.add_argument("--scenario", choices=SCENARIOS, default="load",
+                        help="what to measure: load replays the command " +
+                        "mix, dispatch compares the command registry " +
+                        "to the previous lookup and signature " +
+                        "inspection, indexes times the account queries " +
+                        "with and without the indexes, user_names " +
+                        "compares naming the users of a listing to " +
+                        "fetching them one at a time")
+    parser.add_argument("--commands", type=int, default=2000,
+                        help="number of commands to replay")
+    parser.add_argument("--concurrency", type=int, default=50,
+                        help="number of commands handled at the same time")
+    parser.add_argument("--users", type=int, default=200,
+                        help="number of distinct users sending commands")
+    parser.add_argument("--channels", type=int, default=10,
+                        help="number of channels the commands are sent in")
+    parser.add_argument("--seed-accounts", type=int, default=None,
+                        help="number of accounts inserted before the run " +
+                        "(default 0, or 100000 for the indexes scenario)")
+    parser.add_argument("--rest-latency", type=float, default=50,
+                        help="simulated latency of REST calls, in ms")
+    parser.add_argument("--allocations", type=int, default=20,
+                        help="calls per command measured with tracemalloc " +
+                        "(0 to skip)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the random command mix")
+    parser.add_argument("--output", default=None,
+                        help="JSON file the results are written to")
+    parser.add_argument("--compare", default=None,
+                        help="JSON results of a previous run to compare to")
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    args = parse_args()
+    if args.seed_accounts is None:
+        args.seed_accounts = 100000 if args.scenario == "indexes" else 0
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bot = build_bot(tmp_dir, args.rest_latency / 1000)
+        messages = build_messages(args.commands, args.users, args.channels,
+                                  args.seed)
+
+        async def benchmark():
+            if args.seed_accounts:
+                await seed_accounts(args.seed_accounts, args.users)
+            latencies, duration = await run_load(bot, messages,
+                                                 args.concurrency)
+            allocations = dict()
+            if args.allocations:
+                messages_by_command = dict()
+                for name, message in build_messages(
+                        args.allocations * len(COMMAND_MIX) * 4, args.users,
+                        args.channels, args.seed + 1):
+                    messages_by_command.setdefault(name, []).append(message)
+                allocations = await measure_allocations(
+                    bot, messages_by_command, args.allocations)
+            return summarize(latencies, duration, allocations)
+
+        if args.scenario == "dispatch":
+            results = measure_dispatch(bot, messages)
+        elif args.scenario == "indexes":
+            bot.loop.run_until_complete(
+                seed_accounts(args.seed_accounts, args.users))
+            results = measure_index_queries(200, args.users, args.seed)
+        elif args.scenario == "user_names":
+            results = bot.loop.run_until_complete(
+                measure_user_names(bot, args.users))
+        else:
+            results = bot.loop.run_until_complete(benchmark())
+
+    results["run"] = {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_revision": get_git_revision(),
+        "python": platform.python_version(),
+        "parameters": vars(args)}
+
+    if args.scenario != "load":
+        print_measurements(results)
+    else:
+        previous = None
+        if args.compare:
+            with open(args.compare) as f:
+                previous = json.load(f)
+        print_results(results, previous)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1 +1,7 @@
-from .haruhichanbot import HaruhiChanBot
+def __getattr__(name):
+    # Imported on first use, so that e.g. haruhichanbot.config or
+    # haruhichanbot.db_manager can be used without loading discord.py
+    if name == "HaruhiChanBot":
+        from .haruhichanbot import HaruhiChanBot
+        return HaruhiChanBot
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,103 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from . import db_manager
+from . import metrics
+from . import profiling
+
+# This global is initialized in init()
+executor = None
+
+
+def init(config):
+    """
+    Initialize the database and the thread pool running the queries
+    The pool has one thread per available database connection
+    """
+    global executor
+
+    db_manager.init_session(config)
+    max_workers = (config.sql_infos['pool_size'] +
+                   config.sql_infos['max_overflow'])
+    executor = ThreadPoolExecutor(max_workers=max_workers,
+                                  thread_name_prefix="haruhichanbot-db")
+
+
+async def run(func, *args, **kwargs):
+    """
+    Runs a blocking db_manager function in the database thread pool
+    so that it never blocks the event loop
+    """
+    def timed_call():
+        with metrics.db_query_seconds.time((func.__name__,)):
+            return func(*args, **kwargs)
+
+    loop = asyncio.get_event_loop()
+    with profiling.phase("db"):
+        return await loop.run_in_executor(executor, timed_call)
+
+
+async def connect(create_tables=False):
+    """See db_manager.connect"""
+    return await run(db_manager.connect, create_tables)
+
+
+async def insert_user_account(**kwargs):
+    """See db_manager.insert_user_account"""
+    return await run(db_manager.insert_user_account, **kwargs)
+
+
+async def get_accounts_for_user(discord_guild_id, discord_user_id):
+    """See db_manager.get_accounts_for_user"""
+    # Cache hits are answered without going through the thread pool
+    accounts = db_manager.get_accounts_for_user(
+        discord_guild_id, discord_user_id, cache_only=True)
+    if accounts is None:
+        accounts = await run(db_manager.get_accounts_for_user,
+                             discord_guild_id, discord_user_id)
+    return accounts
+
+
+async def get_accounts_for_source_and_server(**kwargs):
+    """See db_manager.get_accounts_for_source_and_server"""
+    accounts = db_manager.get_accounts_for_source_and_server(
+        cache_only=True, **kwargs)
+    if accounts is None:
+        accounts = await run(db_manager.get_accounts_for_source_and_server,
+                             **kwargs)
+    return accounts
+
+
+async def count_accounts_for_source_and_server(**kwargs):
+    """See db_manager.count_accounts_for_source_and_server"""
+    nb_accounts = db_manager.count_accounts_for_source_and_server(
+        cache_only=True, **kwargs)
+    if nb_accounts is None:
+        nb_accounts = await run(
+            db_manager.count_accounts_for_source_and_server, **kwargs)
+    return nb_accounts
+
+
+async def remove_server_accounts_for_user(**kwargs):
+    """See db_manager.remove_server_accounts_for_user"""
+    return await run(db_manager.remove_server_accounts_for_user, **kwargs)
+
+
+async def remove_account(**kwargs):
+    """See db_manager.remove_account"""
+    return await run(db_manager.remove_account, **kwargs)
+
+
+async def insert_role_menu(**kwargs):
+    """See db_manager.insert_role_menu"""
+    return await run(db_manager.insert_role_menu, **kwargs)
+
+
+async def get_role_menus():
+    """See db_manager.get_role_menus"""
+    return await run(db_manager.get_role_menus)
+
+
+async def remove_role_menu(message_id):
+    """See db_manager.remove_role_menu"""
+    return await run(db_manager.remove_role_menu, message_id)
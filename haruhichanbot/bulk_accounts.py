@@ -0,0 +1,148 @@
+import csv
+import io
+import json
+
+from . import db_manager
+from . import exceptions
+
+FIELDS = ("discord_guild_id", "discord_user_id", "account_source",
+          "account_server", "account_name", "comment")
+FORMATS = ("csv", "json", "jsonl")
+
+
+def get_file_format(file_name):
+    """Returns the format of an accounts file from its extension"""
+    file_format = file_name.rsplit(".", 1)[-1].lower()
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown file format `{file_format}`, " +
+                         "use one of: " + ", ".join(FORMATS))
+    return file_format
+
+
+def read_rows(f, file_format):
+    """
+    Yields the accounts of a text file as dicts
+    CSV files need a header line, JSON files hold a list of objects
+    and JSON lines files one object per line
+    """
+    if file_format == "csv":
+        yield from csv.DictReader(f)
+    elif file_format == "json":
+        yield from json.load(f)
+    else:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def validate_rows(rows, cmd_cfg, guild_id=None):
+    """
+    Returns the valid and deduplicated accounts of rows, with the real
+    names of their sources and servers, and the errors of the other rows
+    If guild_id is set, every account is imported in this guild,
+    otherwise the rows need a discord_guild_id
+    """
+    accounts = list()
+    errors = list()
+    seen = set()
+    for line, row in enumerate(rows, 1):
+        try:
+            account = _validate_row(row, cmd_cfg, guild_id)
+        except (ValueError, exceptions.HaruhiChanBotException) as e:
+            errors.append(f"Row {line}: {e}")
+            continue
+        key = (account["discord_guild_id"], account["discord_user_id"],
+               account["account_source"], account["account_server"],
+               account["account_name"])
+        if key not in seen:
+            seen.add(key)
+            accounts.append(account)
+    return accounts, errors
+
+
+def _validate_row(row, cmd_cfg, guild_id):
+    if not isinstance(row, dict):
+        raise ValueError("not an object")
+    account = {field: str(row[field]).strip() if row.get(field) else None
+               for field in FIELDS}
+    if guild_id is not None:
+        account["discord_guild_id"] = str(guild_id)
+    if not (account["discord_guild_id"] or "").isdigit():
+        raise ValueError("invalid discord_guild_id")
+    if not (account["discord_user_id"] or "").isdigit():
+        raise ValueError("invalid discord_user_id")
+    if not account["account_name"] or len(account["account_name"]) > 64:
+        raise ValueError("account_name must have 1 to 64 characters")
+
+    try:
+        source, source_infos = cmd_cfg.get_account_source_infos(
+            account["account_source"] or "")
+    except exceptions.NoAccountSourceInfosException:
+        raise exceptions.AccountSourceNotFoundException(
+            account["account_source"])
+    account["account_source"] = source
+
+    server = account["account_server"]
+    if server:
+        if not source_infos["servers"]:
+            raise exceptions.AccountHasNoServerWarning()
+        if not cmd_cfg.is_valid_server(source, server):
+            raise exceptions.InvalidAccountServerException(
+                server, source, ", ".join(source_infos["servers"]))
+        account["account_server"] = server.lower()
+    elif source_infos["servers"]:
+        raise exceptions.AccountServerRequiredException()
+    return account
+
+
+def import_accounts(f, file_format, cmd_cfg, guild_id=None, batch_size=1000):
+    """
+    Imports the accounts of a file, in transactions of batch_size accounts
+    See validate_rows for guild_id
+    Returns the number of accounts read, of accounts inserted,
+    and the errors of the invalid rows
+    """
+    accounts, errors = validate_rows(read_rows(f, file_format), cmd_cfg,
+                                     guild_id)
+    nb_inserted = 0
+    for start in range(0, len(accounts), batch_size):
+        nb_inserted += db_manager.bulk_insert_user_accounts(
+            accounts[start:start + batch_size])
+    return len(accounts), nb_inserted, errors
+
+
+def import_accounts_data(data, file_name, cmd_cfg, guild_id=None,
+                         batch_size=1000):
+    """Same as import_accounts, for the raw content of a file"""
+    f = io.StringIO(data.decode("utf-8-sig"), newline="")
+    return import_accounts(f, get_file_format(file_name), cmd_cfg,
+                           guild_id, batch_size)
+
+
+def export_accounts(f, file_format, batch_size=1000):
+    """
+    Writes every account to a text file, reading them from the database
+    batch_size at a time
+    Returns the number of accounts written
+    """
+    accounts = db_manager.iter_user_accounts(batch_size)
+    nb_accounts = 0
+    if file_format == "csv":
+        writer = csv.writer(f)
+        writer.writerow(FIELDS)
+        for account in accounts:
+            writer.writerow(account)
+            nb_accounts += 1
+    elif file_format == "json":
+        f.write("[")
+        for account in accounts:
+            if nb_accounts:
+                f.write(",")
+            f.write("\n" + json.dumps(dict(zip(FIELDS, account))))
+            nb_accounts += 1
+        f.write("\n]\n")
+    else:
+        for account in accounts:
+            f.write(json.dumps(dict(zip(FIELDS, account))) + "\n")
+            nb_accounts += 1
+    return nb_accounts
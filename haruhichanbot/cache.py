@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache():
+    """
+    A least recently used cache of at most maxsize entries
+    If ttl is set, entries also expire ttl seconds after being set
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, default=None):
+        """Returns the value cached for key, or default"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if expires_at is None or expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+        self.misses += 1
+        return default
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class InvalidatingCache():
+    """
+    A thread-safe LRUCache of query results grouped by key (a user,
+    a source...), where params identify a result in its group
+    Invalidating a key bumps its version rather than deleting entries,
+    so a result read before a write can't be cached after it
+    Versions are kept for the maxsize keys invalidated last, the other
+    keys share a base version newer than every version dropped
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        self.hits = 0
+        self.misses = 0
+        self.maxsize = maxsize
+        self._results = LRUCache(maxsize, ttl)
+        self._versions = OrderedDict()
+        self._last_version = 0
+        self._base_version = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, params=()):
+        """
+        Returns the cached result or None, and the token to pass to set()
+        Must be called before running the query to cache
+        """
+        with self._lock:
+            token = (key, self._versions.get(key, self._base_version),
+                     params)
+            result = self._results.get(token)
+            if result is not None:
+                self.hits += 1
+            return result, token
+
+    def set(self, token, result):
+        with self._lock:
+            self.misses += 1
+            self._results.set(token, result)
+
+    def clear(self):
+        """Makes every cached result unreachable"""
+        with self._lock:
+            self._results.clear()
+            self._versions.clear()
+            # Results read before clearing can't be cached after it
+            self._last_version += 1
+            self._base_version = self._last_version
+
+    def invalidate(self, *keys):
+        """Makes every result cached for keys unreachable"""
+        with self._lock:
+            for key in keys:
+                self._last_version += 1
+                self._versions[key] = self._last_version
+                self._versions.move_to_end(key)
+            if len(self._versions) > self.maxsize:
+                while len(self._versions) > self.maxsize:
+                    self._versions.popitem(last=False)
+                # The results cached for the keys without a version
+                # can't be told apart from stale ones anymore
+                self._last_version += 1
+                self._base_version = self._last_version
+
+    def __len__(self):
+        return len(self._results)
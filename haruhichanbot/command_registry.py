@@ -0,0 +1,114 @@
+import inspect
+import textwrap
+
+
+# Values that can be injected in a command handler, by parameter name.
+# Each getter receives the triggering message and the command arguments.
+INJECTABLES = {
+    "user_id": lambda message, args: message.author.id,
+    "user": lambda message, args: message.author,
+    "guild": lambda message, args: message.guild,
+    "guild_id": lambda message, args: message.guild.id,
+    "channel": lambda message, args: message.channel,
+    "mentions": lambda message, args: message.mentions,
+    "role_mentions": lambda message, args: message.role_mentions,
+    "cmd_args": lambda message, args: args,
+    "attachments": lambda message, args: message.attachments,
+}
+
+
+def command(*, aliases=None, admin_only=False, guild_only=False,
+            help_infos=None, timeout=None):
+    """
+    Decorator attaching registry metadata to a cmd_* method
+    Ex: @command(aliases=["rng"])
+    admin_only commands can only be used by server administrators
+    guild_only commands can't be used in direct messages
+    help_infos names the informations appended to the command's help,
+    "accounts" for the account sources or "roles" for the assignable roles
+    timeout replaces the default number of seconds after which
+    the command is cancelled
+    """
+    def decorator(func):
+        func.command_aliases = tuple(alias.lower() for alias in aliases or ())
+        func.command_admin_only = admin_only
+        func.command_guild_only = guild_only
+        func.command_help_infos = help_infos
+        func.command_timeout = timeout
+        return func
+    return decorator
+
+
+class Command():
+    """
+    A command handler with everything needed to call it
+    precomputed once (injection plan, aliases and docstring)
+    """
+
+    def __init__(self, name, handler):
+        self.name = name
+        self.handler = handler
+        self.aliases = getattr(handler, "command_aliases", ())
+        self.admin_only = getattr(handler, "command_admin_only", False)
+        self.guild_only = getattr(handler, "command_guild_only", False)
+        self.help_infos = getattr(handler, "command_help_infos", None)
+        self.timeout = getattr(handler, "command_timeout", None)
+
+        self.doc = textwrap.dedent(handler.__doc__ or "")
+        doc_lines = [line.strip() for line in self.doc.split('\n')]
+        self.summary = next((line for line in doc_lines if line), "")
+
+        # Skips 'self', handlers are stored unbound
+        params = list(inspect.signature(handler).parameters)[1:]
+        unknown_params = [p for p in params if p not in INJECTABLES]
+        if unknown_params:
+            raise ValueError(
+                f"Command {name} has parameters that can't be injected: " +
+                ", ".join(unknown_params))
+        if "guild_id" in params and not self.guild_only:
+            raise ValueError(
+                f"Command {name} needs guild_id but isn't guild_only")
+        self.injection_plan = tuple((p, INJECTABLES[p]) for p in params)
+
+    def is_allowed(self, user):
+        """Returns whether user can use this command"""
+        if not self.admin_only:
+            return True
+        # Users outside of a server (DMs) have no permissions
+        permissions = getattr(user, "guild_permissions", None)
+        return permissions is not None and permissions.administrator
+
+    def bind(self, message, args):
+        """Returns the keyword arguments to call the handler with"""
+        return {param: getter(message, args)
+                for param, getter in self.injection_plan}
+
+
+class CommandRegistry():
+    """
+    Every cmd_* method of a client class, indexed by name and alias
+    Built once at startup so that dispatch is a single dict lookup
+    """
+    handler_prefix = "cmd_"
+
+    def __init__(self, client_cls):
+        self.commands = dict()
+        self._lookup = dict()
+
+        for attr_name, func in inspect.getmembers(client_cls,
+                                                  inspect.isfunction):
+            if not attr_name.startswith(self.handler_prefix):
+                continue
+            cmd = Command(attr_name[len(self.handler_prefix):], func)
+            self.commands[cmd.name] = cmd
+            for name in (cmd.name,) + cmd.aliases:
+                if name in self._lookup:
+                    raise ValueError(f"Duplicate command name or alias {name}")
+                self._lookup[name] = cmd
+
+    def get(self, name):
+        """Returns the Command for a name or an alias, or None"""
+        return self._lookup.get(name)
+
+    def __iter__(self):
+        return iter(self.commands.values())
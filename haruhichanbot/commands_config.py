@@ -1,4 +1,5 @@
 import json
+import re
 
 from . import exceptions
 
@@ -9,10 +10,99 @@ class CommandsConfig():
             json_cfg_file = CommandsConfigDefaults.json_cfg_file
         self.json_cfg_file = json_cfg_file
 
-        with open(self.json_cfg_file, "r") as f:
+        with open(self.json_cfg_file, "r", encoding="utf-8") as f:
             cfg_json = json.load(f)
+        self._validate(cfg_json)
         self.account_sources = cfg_json["account_sources"]
         self.roles = cfg_json["roles"]
+        self._build_indexes()
+
+    def _validate(self, cfg_json):
+        """
+        Checks the structure of the settings
+        Raises exceptions.InvalidCommandsConfigException on the first error
+        """
+        def check(condition, msg):
+            if not condition:
+                raise exceptions.InvalidCommandsConfigException(
+                    f"{self.json_cfg_file}: {msg}")
+
+        check(isinstance(cfg_json, dict), "settings must be an object")
+        for section in ("account_sources", "roles"):
+            check(isinstance(cfg_json.get(section), dict),
+                  f"`{section}` must be an object")
+
+        for source, source_infos in cfg_json["account_sources"].items():
+            check(isinstance(source_infos, dict),
+                  f"account source `{source}` must be an object")
+            for key in ("aliases", "servers"):
+                check(key in source_infos,
+                      f"account source `{source}` must have `{key}`")
+                value = source_infos[key]
+                check(value is None or (isinstance(value, list) and
+                                        all(isinstance(x, str)
+                                            for x in value)),
+                      f"`{key}` of `{source}` must be a list of strings " +
+                      "or null")
+
+        # Each name or alias must lead to a single source
+        source_names = dict()
+        for source, source_infos in cfg_json["account_sources"].items():
+            for name in [source] + (source_infos["aliases"] or []):
+                other_source = source_names.setdefault(name.lower(), source)
+                check(other_source == source,
+                      f"`{name}` of `{source}` is already a name or " +
+                      f"an alias of `{other_source}`")
+
+        for role, role_desc in cfg_json["roles"].items():
+            check(isinstance(role_desc, dict),
+                  f"role `{role}` must be an object")
+            check(isinstance(role_desc.get("id"), int),
+                  f"`id` of role `{role}` must be an integer")
+            for key in ("title", "description"):
+                check(isinstance(role_desc.get(key), str),
+                      f"`{key}` of role `{role}` must be a string")
+            check(isinstance(role_desc.get("emoji", ""), str),
+                  f"`emoji` of role `{role}` must be a string")
+
+        emoji_keys = [_parse_emoji(role_desc["emoji"])[1]
+                      for role_desc in cfg_json["roles"].values()
+                      if role_desc.get("emoji")]
+        check(len(emoji_keys) == len(set(emoji_keys)),
+              "roles must have different emojis")
+
+    def _build_indexes(self):
+        """
+        Builds the lowercase lookup tables used by the getters,
+        so that they never have to go through every source and alias
+        """
+        # Lowercase name or alias -> real name of the account source
+        self.source_names = dict()
+        # Real name of the account source -> set of lowercase servers
+        self.source_servers = dict()
+        for source, source_infos in self.account_sources.items():
+            self.source_names[source.lower()] = source
+            for alias in source_infos["aliases"] or ():
+                self.source_names[alias.lower()] = source
+            self.source_servers[source] = {
+                server.lower() for server in source_infos["servers"] or ()}
+
+        # Unicode emoji or custom emoji ID -> role name, and role name ->
+        # emoji as used to react, for the roles of the reaction menus
+        self.emoji_roles = dict()
+        self.role_emojis = dict()
+        for role, role_desc in self.roles.items():
+            if role_desc.get("emoji"):
+                reaction, key = _parse_emoji(role_desc["emoji"])
+                self.emoji_roles[key] = role
+                self.role_emojis[role] = reaction
+
+        # Every name and alias, and these with one character deleted
+        # -> real names of the sources (one-typo suggestions)
+        self._suggestions = dict()
+        for name, source in self.source_names.items():
+            for variant in _deletions(name) | {name}:
+                self._suggestions.setdefault(variant, set()).add(source)
 
     def get_account_source_infos(self, account_source):
         """
@@ -20,14 +110,45 @@ class CommandsConfig():
         Also manages account sources aliases
         Raises exception.NoAccountSourceInfosException if no infos were found
         """
-        for source, source_infos in self.account_sources.items():
-            if account_source.lower() == source.lower():
-                return (source, source_infos)
-            if source_infos["aliases"]:
-                for alias in source_infos["aliases"]:
-                    if account_source.lower() == alias.lower():
-                        return (source, source_infos)
-        raise exceptions.NoAccountSourceInfosException()
+        source = self.source_names.get(account_source.lower())
+        if source is None:
+            raise exceptions.NoAccountSourceInfosException()
+        return (source, self.account_sources[source])
+
+    def is_valid_server(self, account_source, account_server):
+        """
+        Returns whether account_server (case insensitive) is a server
+        of the account source with the real name account_source
+        """
+        return account_server.lower() in self.source_servers[account_source]
+
+    def suggest_account_sources(self, account_source):
+        """
+        Returns the sorted real names of the account sources whose name
+        or an alias is at most one typo away from account_source
+        """
+        name = account_source.lower()
+        suggestions = set()
+        for variant in _deletions(name) | {name}:
+            suggestions.update(self._suggestions.get(variant, ()))
+        return sorted(suggestions)
+
+
+def _parse_emoji(emoji):
+    """
+    Returns the reaction string and the lookup key of an emoji,
+    either unicode or custom as <:name:id> or name:id
+    The key of a custom emoji is its ID, which never changes
+    """
+    match = re.fullmatch(r"(?:<a?:)?(\w+):(\d+)>?", emoji.strip())
+    if match:
+        return f"{match[1]}:{match[2]}", match[2]
+    return emoji.strip(), emoji.strip()
+
+
+def _deletions(word):
+    """Returns every string made by deleting one character of word"""
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
 
 
 class CommandsConfigDefaults():
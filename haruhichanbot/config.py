@@ -15,20 +15,164 @@ class Config():
             "Chat", "CommandPrefix")
 
         self.sql_infos = dict()
+        # Username, password, host and port are not used by SQLite
         self.sql_infos['username'] = parser.get("Credentials",
-                                                "SqlUsername")
+                                                "SqlUsername", fallback=None)
         self.sql_infos['password'] = parser.get("Credentials",
-                                                "SqlPassword")
+                                                "SqlPassword", fallback=None)
         self.sql_infos['host'] = parser.get("Credentials",
-                                            "SqlHost")
+                                            "SqlHost", fallback=None)
         self.sql_infos['database'] = parser.get("Credentials",
                                                 "SqlDatabase")
         self.sql_infos['port'] = parser.get("Credentials",
-                                            "SqlPort")
+                                            "SqlPort", fallback=None)
         self.sql_infos['db_api'] = parser.get("Credentials",
                                               "SqlDbApi")
+        self.sql_infos['pool_size'] = parser.getint(
+            "Database", "PoolSize", fallback=ConfigDefaults.sql_pool_size)
+        self.sql_infos['max_overflow'] = parser.getint(
+            "Database", "MaxOverflow",
+            fallback=ConfigDefaults.sql_max_overflow)
+        self.sql_infos['pool_pre_ping'] = parser.getboolean(
+            "Database", "PoolPrePing",
+            fallback=ConfigDefaults.sql_pool_pre_ping)
+        self.sql_infos['create_tables'] = parser.getboolean(
+            "Database", "CreateTables",
+            fallback=ConfigDefaults.sql_create_tables)
+
+        self.users_cache_size = parser.getint(
+            "Cache", "UsersCacheSize",
+            fallback=ConfigDefaults.users_cache_size)
+        self.users_cache_ttl = parser.getint(
+            "Cache", "UsersCacheTtl",
+            fallback=ConfigDefaults.users_cache_ttl)
+        self.member_snapshot_file = parser.get(
+            "Cache", "MemberSnapshotFile",
+            fallback=ConfigDefaults.member_snapshot_file)
+        self.member_snapshot_flush_interval = parser.getfloat(
+            "Cache", "MemberSnapshotFlushInterval",
+            fallback=ConfigDefaults.member_snapshot_flush_interval)
+        self.fetch_user_concurrency = parser.getint(
+            "Cache", "FetchUserConcurrency",
+            fallback=ConfigDefaults.fetch_user_concurrency)
+        self.accounts_cache_enabled = parser.getboolean(
+            "Cache", "AccountsCacheEnabled",
+            fallback=ConfigDefaults.accounts_cache_enabled)
+        self.accounts_cache_size = parser.getint(
+            "Cache", "AccountsCacheSize",
+            fallback=ConfigDefaults.accounts_cache_size)
+        self.accounts_cache_ttl = parser.getint(
+            "Cache", "AccountsCacheTtl",
+            fallback=ConfigDefaults.accounts_cache_ttl)
+
+        self.commands_settings_poll_interval = parser.getfloat(
+            "CommandsSettings", "PollInterval",
+            fallback=ConfigDefaults.commands_settings_poll_interval)
+
+        # 0 lets Discord choose the number of shards
+        self.shard_count = parser.getint(
+            "Sharding", "ShardCount",
+            fallback=ConfigDefaults.shard_count) or None
+        self.workers = parser.getint(
+            "Sharding", "Workers", fallback=ConfigDefaults.workers)
+
+        self.list_page_size = parser.getint(
+            "Listing", "PageSize", fallback=ConfigDefaults.list_page_size)
+        self.list_batch_size = parser.getint(
+            "Listing", "BatchSize", fallback=ConfigDefaults.list_batch_size)
+
+        # Scope -> (commands per second, burst), a rate of 0 disables it
+        self.rate_limits = dict()
+        for scope in ("User", "Channel", "Command"):
+            rate = parser.getfloat(
+                "RateLimit", scope + "Rate",
+                fallback=ConfigDefaults.rate_limits[scope][0])
+            burst = parser.getint(
+                "RateLimit", scope + "Burst",
+                fallback=ConfigDefaults.rate_limits[scope][1])
+            if rate > 0:
+                self.rate_limits[scope.lower()] = (rate, burst)
+
+        self.send_rate = parser.getfloat(
+            "SendQueue", "Rate", fallback=ConfigDefaults.send_rate)
+        self.send_burst = parser.getint(
+            "SendQueue", "Burst", fallback=ConfigDefaults.send_burst)
+
+        self.role_batch_rate = parser.getfloat(
+            "RoleBatch", "Rate", fallback=ConfigDefaults.role_batch_rate)
+        self.role_batch_burst = parser.getint(
+            "RoleBatch", "Burst", fallback=ConfigDefaults.role_batch_burst)
+
+        self.slash_commands_enabled = parser.getboolean(
+            "SlashCommands", "Enabled",
+            fallback=ConfigDefaults.slash_commands_enabled)
+        self.prefix_commands_enabled = parser.getboolean(
+            "SlashCommands", "PrefixCommands",
+            fallback=ConfigDefaults.prefix_commands_enabled)
+        self.slash_commands_defer_delay = parser.getfloat(
+            "SlashCommands", "DeferDelay",
+            fallback=ConfigDefaults.slash_commands_defer_delay)
+
+        self.max_concurrent_commands = parser.getint(
+            "Scheduler", "MaxConcurrentCommands",
+            fallback=ConfigDefaults.max_concurrent_commands)
+        self.command_timeout = parser.getfloat(
+            "Scheduler", "CommandTimeout",
+            fallback=ConfigDefaults.command_timeout)
+
+        self.metrics_enabled = parser.getboolean(
+            "Metrics", "Enabled", fallback=ConfigDefaults.metrics_enabled)
+        self.metrics_host = parser.get(
+            "Metrics", "Host", fallback=ConfigDefaults.metrics_host)
+        self.metrics_port = parser.getint(
+            "Metrics", "Port", fallback=ConfigDefaults.metrics_port)
+
+        self.watchdog_threshold = parser.getfloat(
+            "Debug", "WatchdogThreshold",
+            fallback=ConfigDefaults.watchdog_threshold)
+        self.slow_command_threshold = parser.getfloat(
+            "Debug", "SlowCommandThreshold",
+            fallback=ConfigDefaults.slow_command_threshold)
+        self.profile_directory = parser.get(
+            "Debug", "ProfileDirectory",
+            fallback=ConfigDefaults.profile_directory)
 
 
 class ConfigDefaults():
     """Default configuration values"""
     config_file = "config/config.ini"
+    sql_pool_size = 5
+    sql_max_overflow = 5
+    sql_pool_pre_ping = True
+    sql_create_tables = False
+    users_cache_size = 10000
+    users_cache_ttl = 3600
+    member_snapshot_file = "member_snapshot.db"
+    member_snapshot_flush_interval = 30
+    fetch_user_concurrency = 10
+    accounts_cache_enabled = True
+    accounts_cache_size = 10000
+    accounts_cache_ttl = 600
+    commands_settings_poll_interval = 0
+    shard_count = 0
+    workers = 1
+    list_page_size = 500
+    list_batch_size = 50
+    rate_limits = {"User": (0.5, 5),
+                   "Channel": (2, 10),
+                   "Command": (0.2, 3)}
+    send_rate = 1
+    send_burst = 5
+    role_batch_rate = 1
+    role_batch_burst = 5
+    slash_commands_enabled = False
+    prefix_commands_enabled = True
+    slash_commands_defer_delay = 1
+    max_concurrent_commands = 50
+    command_timeout = 60
+    metrics_enabled = False
+    metrics_host = "127.0.0.1"
+    metrics_port = 9100
+    watchdog_threshold = 0
+    slow_command_threshold = 2
+    profile_directory = "profiles"
@@ -1,52 +1,277 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text
+import logging
+from contextlib import contextmanager
+
+from sqlalchemy import (and_, create_engine, func, inspect, or_, text,
+                        Column, Index, Integer, MetaData, String, Table, Text)
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.engine.url import URL
 
 from . import exceptions
+from .cache import InvalidatingCache
 
 Base = declarative_base()
 # These globals are initialized in init_session()
 engine = None
 Session = None
-session = None
+# Read-through cache of the account queries, None if disabled
+accounts_cache = None
+# Indexes replaced by newer ones, dropped by migrate()
+OBSOLETE_INDEXES = ("uq_user_accounts_account",
+                    "ix_user_accounts_source_server_name")
+# Server stored for the accounts without server: NULL values are never
+# equal in a unique index, so they couldn't be rejected as duplicates
+NO_SERVER = ""
 
 
 class UserAccounts(Base):
     __tablename__ = "user_accounts"
+    # Every index starts with the guild, so that the queries of a guild
+    # only read its own accounts
+    __table_args__ = (
+        # Rejects duplicate accounts, also used by get_accounts_for_user
+        # which filters on the user and sorts on the other columns
+        Index("uq_user_accounts_guild_account", "discord_guild_id",
+              "discord_user_id", "account_source", "account_server",
+              "account_name", unique=True),
+        # Used by get_accounts_for_source_and_server
+        Index("ix_user_accounts_guild_source_server_name",
+              "discord_guild_id", "account_source", "account_server",
+              "account_name"),
+    )
     account_id = Column(Integer, primary_key=True)
+    # NULL for the accounts registered before they were scoped by guild,
+    # until they are backfilled
+    discord_guild_id = Column(String(20))
     # Note: most of the Discord snowflake ID are 18 characters
     # but there's no official infos on the max length of those ID
     discord_user_id = Column(String(20), nullable=False)
     account_source = Column(String(64), nullable=False)
-    account_server = Column(String(64))
+    # NO_SERVER if the source has no servers, read back as None
+    account_server = Column(String(64), nullable=False, default=NO_SERVER)
     account_name = Column(String(64), nullable=False)
     comment = Column(Text)
 
 
+# UserAccounts.account_server with NO_SERVER read as None
+ACCOUNT_SERVER = func.nullif(UserAccounts.account_server,
+                             NO_SERVER).label("account_server")
+
+
+class RoleMenus(Base):
+    """Messages whose reactions add or remove the roles with an emoji"""
+    __tablename__ = "role_menus"
+    message_id = Column(String(20), primary_key=True)
+    discord_guild_id = Column(String(20), nullable=False)
+    channel_id = Column(String(20), nullable=False)
+
+
 def init_session(config):
     """
-    Initialize the sqlalchemy session and create tables in database
+    Initialize the sqlalchemy engine and session factory
+    No connection is opened until the first query,
+    the tables are created by connect() or migrate()
     """
     global engine
     global Session
-    global session
+    global accounts_cache
 
+    # Empty values are ignored, e.g. everything but the database for SQLite
     connect_url = URL(
         config.sql_infos['db_api'],
-        username=config.sql_infos['username'],
-        password=config.sql_infos['password'],
-        host=config.sql_infos['host'],
-        port=config.sql_infos['port'],
+        username=config.sql_infos['username'] or None,
+        password=config.sql_infos['password'] or None,
+        host=config.sql_infos['host'] or None,
+        port=config.sql_infos['port'] or None,
         database=config.sql_infos['database'])
 
-    engine = create_engine(connect_url, pool_recycle=3600)
+    engine_kwargs = dict(pool_recycle=3600,
+                         pool_pre_ping=config.sql_infos['pool_pre_ping'])
+    if connect_url.drivername.startswith("sqlite"):
+        # Sessions are used from the database thread pool
+        engine_kwargs['connect_args'] = {"check_same_thread": False}
+    else:
+        engine_kwargs['pool_size'] = config.sql_infos['pool_size']
+        engine_kwargs['max_overflow'] = config.sql_infos['max_overflow']
+
+    engine = create_engine(connect_url, **engine_kwargs)
     Session = sessionmaker(bind=engine)
-    session = Session()
+    if config.accounts_cache_enabled:
+        accounts_cache = InvalidatingCache(config.accounts_cache_size,
+                                           config.accounts_cache_ttl)
+
+
+def connect(create_tables=False):
+    """
+    Opens a first connection to the database so that the first command
+    doesn't wait for it, creating the missing tables if create_tables is set
+    """
+    if create_tables:
+        Base.metadata.create_all(engine)
+    else:
+        with engine.connect():
+            pass
+
+
+def migrate():
+    """
+    Brings the schema of an existing database up to date
+    by creating the missing tables, columns and indexes
+    Creating the unique index fails if duplicate accounts were registered
+    """
+    logger = logging.getLogger("haruhichanbot")
     Base.metadata.create_all(engine)
 
+    for table in Base.metadata.sorted_tables:
+        existing_columns = {column["name"] for column in
+                            inspect(engine).get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                logger.info(f"Adding column {column.name} to {table.name}")
+                with engine.begin() as connection:
+                    connection.execute(text(
+                        "ALTER TABLE {0} ADD COLUMN {1} {2}".format(
+                            table.name, column.name,
+                            column.type.compile(dialect=engine.dialect))))
 
-def insert_user_account(*, discord_user_id,
+        if table is UserAccounts.__table__:
+            _migrate_no_server()
+
+        reflected_table = Table(table.name, MetaData(), autoload_with=engine)
+        for index in reflected_table.indexes:
+            if index.name in OBSOLETE_INDEXES:
+                logger.info(f"Dropping index {index.name} on {table.name}")
+                index.drop(engine)
+
+        existing_indexes = {index["name"] for index in
+                            inspect(engine).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                logger.info(f"Creating index {index.name} on {table.name}")
+                index.create(engine)
+
+
+def _migrate_no_server():
+    """
+    Replaces the NULL servers of the accounts by NO_SERVER, after removing
+    the duplicates that NULL let through
+    """
+    logger = logging.getLogger("haruhichanbot")
+    with engine.begin() as connection:
+        # Wrapped in a derived table, which MySQL requires to delete
+        # from the table read by the subquery
+        nb_removed = connection.execute(text(
+            "DELETE FROM user_accounts WHERE account_server IS NULL "
+            "AND account_id NOT IN (SELECT account_id FROM ("
+            "SELECT MIN(account_id) AS account_id FROM user_accounts "
+            "WHERE account_server IS NULL GROUP BY discord_guild_id, "
+            "discord_user_id, account_source, account_name) AS kept)"
+        )).rowcount
+        nb_updated = connection.execute(
+            UserAccounts.__table__.update()
+            .where(UserAccounts.account_server.is_(None))
+            .values(account_server=NO_SERVER)).rowcount
+    if nb_removed or nb_updated:
+        logger.info(f"Removed {nb_removed} duplicate account(s) and " +
+                    f"set the server of {nb_updated} account(s) " +
+                    "without server")
+
+
+def backfill_guild_id(discord_guild_id):
+    """
+    Moves every account not scoped by guild yet to a guild
+    Returns the number of accounts moved
+    """
+    with session_scope() as session:
+        return (session.query(UserAccounts)
+                       .filter(UserAccounts.discord_guild_id.is_(None))
+                       .update({"discord_guild_id": discord_guild_id},
+                               synchronize_session=False))
+
+
+def backfill_guild_ids(guild_ids_by_user, batch_size=1000):
+    """
+    Copies the accounts not scoped by guild yet in each guild of their
+    user, guild_ids_by_user being a dict of Discord user ID -> guild IDs
+    The accounts of users missing from guild_ids_by_user are kept as is
+    Returns the number of accounts copied and of accounts left unscoped
+    """
+    user_ids = [str(user_id) for user_id in guild_ids_by_user]
+    guild_ids_by_user = {str(user_id): guild_ids for user_id, guild_ids
+                         in guild_ids_by_user.items()}
+    nb_copied = 0
+    for start in range(0, len(user_ids), batch_size):
+        # The accounts of a batch of users are copied in one transaction
+        with session_scope() as session:
+            accounts = (session.query(UserAccounts)
+                               .filter(UserAccounts.discord_guild_id.is_(None))
+                               .filter(UserAccounts.discord_user_id.in_(
+                                   user_ids[start:start + batch_size]))
+                               .all())
+            copies = [dict(discord_guild_id=str(guild_id),
+                           discord_user_id=account.discord_user_id,
+                           account_source=account.account_source,
+                           account_server=account.account_server,
+                           account_name=account.account_name,
+                           comment=account.comment)
+                      for account in accounts
+                      for guild_id in guild_ids_by_user[
+                          account.discord_user_id]]
+            for account in accounts:
+                session.delete(account)
+            session.flush()
+            nb_copied += _insert_ignore(session, copies)[1]
+
+    with session_scope() as session:
+        nb_unscoped = (session.query(UserAccounts.account_id)
+                              .filter(UserAccounts.discord_guild_id.is_(None))
+                              .count())
+    return nb_copied, nb_unscoped
+
+
+def _cached(key, params, query, cache_only=False):
+    """
+    Returns the result of query() from the accounts cache,
+    running it and caching its result on a miss
+    Returns None on a miss if cache_only is set
+    """
+    if accounts_cache is None:
+        return None if cache_only else query()
+    result, token = accounts_cache.get(key, params)
+    if result is None and not cache_only:
+        result = query()
+        accounts_cache.set(token, result)
+    return result
+
+
+def _invalidate_accounts(discord_guild_id, discord_user_id, account_source):
+    """Invalidates the cached results changed by a write"""
+    if accounts_cache is not None:
+        accounts_cache.invalidate(
+            ("user", str(discord_guild_id), str(discord_user_id)),
+            ("source", str(discord_guild_id), account_source))
+
+
+@contextmanager
+def session_scope():
+    """
+    Provides a short-lived session for one operation
+    Commits it on success, rolls it back on error and always closes it
+    """
+    session = Session()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def insert_user_account(*, discord_guild_id,
+                        discord_user_id,
                         account_source,
                         account_server=None,
                         account_name,
@@ -55,82 +280,224 @@ def insert_user_account(*, discord_user_id,
     Insert a new user account in database, and commit session
     If entry already exists, raise exceptions.DuplicateDbEntryWarning
     """
-    exists = (session.query(UserAccounts.account_id)
-                     .filter_by(discord_user_id=discord_user_id,
-                                account_source=account_source,
-                                account_server=account_server,
-                                account_name=account_name)
-                     .scalar() is not None)
-    if exists:
+    # The IDs are stored as strings, and the functions below convert them
+    # too: compared to numbers, MySQL would convert every row to a double
+    # (losing the precision of the IDs) instead of using the indexes
+    discord_guild_id = str(discord_guild_id)
+    discord_user_id = str(discord_user_id)
+    try:
+        with session_scope() as session:
+            dbobj = UserAccounts(discord_guild_id=discord_guild_id,
+                                 discord_user_id=discord_user_id,
+                                 account_source=account_source,
+                                 account_server=account_server or NO_SERVER,
+                                 account_name=account_name,
+                                 comment=comment)
+            session.add(dbobj)
+    except IntegrityError:
         raise exceptions.DuplicateDbEntryWarning(
             "Duplicate entry in database. Value not inserted.")
+    _invalidate_accounts(discord_guild_id, discord_user_id, account_source)
 
-    dbobj = UserAccounts(discord_user_id=discord_user_id,
-                         account_source=account_source,
-                         account_server=account_server,
-                         account_name=account_name,
-                         comment=comment)
-    session.add(dbobj)
-    session.commit()
 
-
-def get_accounts_for_user(discord_user_id):
-    """Get all accounts linked to Discord user
+def get_accounts_for_user(discord_guild_id, discord_user_id,
+                          cache_only=False):
+    """Get all accounts linked to Discord user in a guild
     Sorted by source, server (if applicable) and name"""
-    return (session.query(UserAccounts.account_source,
-                          UserAccounts.account_server,
-                          UserAccounts.account_name)
-                   .filter_by(discord_user_id=discord_user_id)
-                   .order_by(UserAccounts.account_source,
-                             UserAccounts.account_server,
-                             UserAccounts.account_name)
-                   .all())
+    discord_guild_id = str(discord_guild_id)
+    discord_user_id = str(discord_user_id)
+
+    def query():
+        with session_scope() as session:
+            return (session.query(UserAccounts.account_source,
+                                  ACCOUNT_SERVER,
+                                  UserAccounts.account_name)
+                           .filter_by(discord_guild_id=discord_guild_id,
+                                      discord_user_id=discord_user_id)
+                           .order_by(UserAccounts.account_source,
+                                     UserAccounts.account_server,
+                                     UserAccounts.account_name)
+                           .all())
 
+    return _cached(("user", discord_guild_id, discord_user_id),
+                   (), query, cache_only)
 
-def get_accounts_for_source_and_server(*, account_source, account_server=None):
-    query = session.query(UserAccounts.discord_user_id,
-                          UserAccounts.account_server,
-                          UserAccounts.account_name)
 
+def _filter_source_and_server(query, discord_guild_id,
+                              account_source, account_server):
+    query = query.filter_by(discord_guild_id=discord_guild_id,
+                            account_source=account_source)
     if account_server:
-        query = query.filter_by(account_source=account_source,
-                                account_server=account_server)
-    else:
-        query = query.filter_by(account_source=account_source)
+        return query.filter_by(account_server=account_server)
+    return query
 
-    return query.order_by(UserAccounts.account_server,
-                          UserAccounts.account_name).all()
 
+def get_accounts_for_source_and_server(*, discord_guild_id,
+                                       account_source, account_server=None,
+                                       offset=0, limit=None, after=None,
+                                       cache_only=False):
+    """Get the accounts of a guild on a source, and optionally server
+    Sorted by server and name, limit and offset select a slice of them
+    If set, after is the (account_server, account_name, account_id)
+    of the account the slice starts after, so that reading the next
+    accounts doesn't go through the previous ones again"""
+    discord_guild_id = str(discord_guild_id)
 
-def remove_server_accounts_for_user(*, discord_user_id,
-                                    account_source, account_server=None):
-    """Remove all accounts linked to discord user
-    on specified account_source and account_server"""
-    query = session.query(UserAccounts.account_id)
+    def query():
+        with session_scope() as session:
+            query = session.query(UserAccounts.discord_user_id,
+                                  ACCOUNT_SERVER,
+                                  UserAccounts.account_name,
+                                  UserAccounts.account_id)
+            query = _filter_source_and_server(query, discord_guild_id,
+                                              account_source, account_server)
+            if after is not None:
+                server, name, account_id = after
+                server = server or NO_SERVER
+                query = query.filter(or_(
+                    UserAccounts.account_server > server,
+                    and_(UserAccounts.account_server == server,
+                         or_(UserAccounts.account_name > name,
+                             and_(UserAccounts.account_name == name,
+                                  UserAccounts.account_id > account_id)))))
 
-    if account_server:
-        query = query.filter_by(account_source=account_source,
-                                account_server=account_server)
-    else:
-        query = query.filter_by(account_source=account_source)
+            return (query.order_by(UserAccounts.account_server,
+                                   UserAccounts.account_name,
+                                   UserAccounts.account_id)
+                         .offset(offset)
+                         .limit(limit)
+                         .all())
+
+    return _cached(("source", discord_guild_id, account_source),
+                   ("accounts", account_server, offset, limit, after),
+                   query, cache_only)
+
+
+def count_accounts_for_source_and_server(*, discord_guild_id,
+                                         account_source,
+                                         account_server=None,
+                                         cache_only=False):
+    discord_guild_id = str(discord_guild_id)
+
+    def query():
+        with session_scope() as session:
+            query = session.query(UserAccounts.account_id)
+            return _filter_source_and_server(query, discord_guild_id,
+                                             account_source,
+                                             account_server).count()
+
+    return _cached(("source", discord_guild_id, account_source),
+                   ("count", account_server), query, cache_only)
+
+
+def _insert_ignore(session, accounts):
+    """
+    Inserts accounts in session, skipping the accounts already in database
+    Returns the accounts to insert and the number of accounts inserted
+    """
+    # Duplicates are skipped by the unique index
+    insert = (UserAccounts.__table__.insert()
+              .prefix_with("IGNORE", dialect="mysql")
+              .prefix_with("OR IGNORE", dialect="sqlite"))
+    accounts = [dict(account,
+                     account_server=account["account_server"] or NO_SERVER)
+                for account in accounts]
+    if not accounts:
+        return accounts, 0
+    return accounts, session.execute(insert, accounts).rowcount
 
-    nb_removed = query.delete()
-    session.commit()
+
+def bulk_insert_user_accounts(accounts):
+    """
+    Insert many user accounts in one transaction, skipping the accounts
+    already in database
+    accounts is a list of dicts with the UserAccounts columns as keys
+    Returns the number of accounts inserted
+    """
+    with session_scope() as session:
+        accounts, nb_inserted = _insert_ignore(session, accounts)
+
+    for account in accounts:
+        _invalidate_accounts(account["discord_guild_id"],
+                             account["discord_user_id"],
+                             account["account_source"])
+    return nb_inserted
+
+
+def iter_user_accounts(batch_size=1000):
+    """
+    Yields every account as a (discord_guild_id, discord_user_id,
+    account_source, account_server, account_name, comment) tuple
+    Rows are read from the database batch_size at a time
+    """
+    with session_scope() as session:
+        yield from (session.query(UserAccounts.discord_guild_id,
+                                  UserAccounts.discord_user_id,
+                                  UserAccounts.account_source,
+                                  ACCOUNT_SERVER,
+                                  UserAccounts.account_name,
+                                  UserAccounts.comment)
+                           .order_by(UserAccounts.account_id)
+                           .yield_per(batch_size))
+
+
+def remove_server_accounts_for_user(*, discord_guild_id, discord_user_id,
+                                    account_source, account_server=None):
+    """Remove all accounts linked to discord user in a guild
+    on specified account_source and account_server"""
+    discord_guild_id = str(discord_guild_id)
+    discord_user_id = str(discord_user_id)
+    with session_scope() as session:
+        query = session.query(UserAccounts.account_id).filter_by(
+            discord_user_id=discord_user_id)
+        query = _filter_source_and_server(query, discord_guild_id,
+                                          account_source, account_server)
+        nb_removed = query.delete()
+    _invalidate_accounts(discord_guild_id, discord_user_id, account_source)
     return nb_removed
 
 
-def remove_account(*, discord_user_id,
+def remove_account(*, discord_guild_id,
+                   discord_user_id,
                    account_source,
                    account_server=None,
                    account_name):
     """Remove a specific account"""
-    query = session.query(UserAccounts.account_id)
+    discord_guild_id = str(discord_guild_id)
+    discord_user_id = str(discord_user_id)
+    with session_scope() as session:
+        query = session.query(UserAccounts.account_id).filter_by(
+            discord_guild_id=discord_guild_id,
+            discord_user_id=discord_user_id)
 
-    query = query.filter_by(account_source=account_source,
-                            account_name=account_name)
-    if account_server:
-        query = query.filter_by(account_server=account_server)
+        query = query.filter_by(account_source=account_source,
+                                account_name=account_name)
+        if account_server:
+            query = query.filter_by(account_server=account_server)
 
-    nb_removed = query.delete()
-    session.commit()
+        nb_removed = query.delete()
+    _invalidate_accounts(discord_guild_id, discord_user_id, account_source)
     return nb_removed
+
+
+def insert_role_menu(*, message_id, discord_guild_id, channel_id):
+    with session_scope() as session:
+        session.add(RoleMenus(message_id=message_id,
+                              discord_guild_id=discord_guild_id,
+                              channel_id=channel_id))
+
+
+def get_role_menus():
+    """Returns every role menu as (message_id, discord_guild_id, channel_id)"""
+    with session_scope() as session:
+        return (session.query(RoleMenus.message_id,
+                              RoleMenus.discord_guild_id,
+                              RoleMenus.channel_id)
+                       .all())
+
+
+def remove_role_menu(message_id):
+    with session_scope() as session:
+        return (session.query(RoleMenus)
+                       .filter_by(message_id=message_id)
+                       .delete())
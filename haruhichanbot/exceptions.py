@@ -11,14 +11,22 @@ class NoAccountSourceInfosException(HaruhiChanBotException):
     pass
 
 
+class InvalidCommandsConfigException(HaruhiChanBotException):
+    pass
+
+
 class AccountSourceNotFoundException(HaruhiChanBotException):
-    def __init__(self, account_source, msg=None):
-        self.msg = (f"Game/Website `{account_source}` not found.\n" +
-                    "See help for a list of available game/websites")
+    def __init__(self, account_source, suggestions=None, msg=None):
+        self.msg = f"Game/Website `{account_source}` not found.\n"
+        if suggestions:
+            self.msg += "Did you mean: `{0}`?\n".format(
+                "`, `".join(suggestions))
+        self.msg += "See help for a list of available game/websites"
         if msg:
             self.msg = msg
         super().__init__(self, self.msg)
         self.account_source = account_source
+        self.suggestions = suggestions
 
     def __str__(self):
         return self.msg
@@ -64,3 +72,16 @@ class InvalidAccountServerException(HaruhiChanBotException):
 
     def __str__(self):
         return self.msg
+
+
+class InvalidRoleException(HaruhiChanBotException):
+    def __init__(self, role_name, msg=None):
+        super().__init__(self, msg)
+        self.role_name = role_name
+        self.msg = (f"Invalid role `{role_name}`." +
+                    " Please contact administrator.")
+        if msg:
+            self.msg = msg
+
+    def __str__(self):
+        return self.msg
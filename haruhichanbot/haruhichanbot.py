@@ -1,28 +1,140 @@
+import asyncio
 import logging
-import inspect
+import os
 import random
+import sqlite3
 import textwrap
+import time
 
 import discord
 
 from .config import Config
 from .commands_config import CommandsConfig
+from .command_registry import CommandRegistry, command
+from .cache import LRUCache
+from .role_cache import RoleCache
+from .member_snapshot import MemberSnapshot
+from .pagination import pack_lines
+from .rate_limiter import RateLimiter
+from .send_queue import SendQueue
+from .scheduler import CommandScheduler
+from .role_batch import RoleBatchJob, RoleBatchQueue
+from . import async_db
+from . import interactions
 from . import db_manager
+from . import metrics
+from . import profiling
 from . import exceptions
 
 
-class HaruhiChanBot(discord.Client):
+class HaruhiChanBot(discord.AutoShardedClient):
     def __init__(self, config_file=None,
-                 command_config_file=None):
-        super().__init__()
+                 command_config_file=None,
+                 shard_ids=None, shard_count=None, worker_index=0):
         self.config = Config(config_file)
+        # Index of this process among the workers started by ShardLauncher
+        self.worker_index = worker_index
+        super().__init__(shard_ids=shard_ids,
+                         shard_count=shard_count or self.config.shard_count)
         self.cmd_cfg = CommandsConfig(
             command_config_file)
-        db_manager.init_session(self.config)
+        self.commands = CommandRegistry(type(self))
+        self.role_cache = RoleCache(self.cmd_cfg.roles)
+        # Message ID -> (guild ID, channel ID) of the role menus
+        self.role_menus = dict()
+        self.role_menus_task = None
+        self.render_help_texts()
+        # Discord user ID -> user name, shared by every command
+        self.users_cache = LRUCache(self.config.users_cache_size,
+                                    self.config.users_cache_ttl)
+        self.member_snapshot = None
+        if self.config.member_snapshot_file:
+            self.member_snapshot = MemberSnapshot(
+                self.config.member_snapshot_file)
+        self.fetch_user_semaphore = asyncio.Semaphore(
+            self.config.fetch_user_concurrency)
+        # Discord user ID -> task fetching its name, shared by the
+        # listings waiting for the same user
+        self.user_fetches = dict()
+        self.rate_limiters = {
+            scope: RateLimiter(rate, burst)
+            for scope, (rate, burst) in self.config.rate_limits.items()}
+        self.send_queue = SendQueue(self.loop, self.config.send_rate,
+                                    self.config.send_burst)
+        self.role_batch_queue = RoleBatchQueue(
+            self.loop, self.config.role_batch_rate,
+            self.config.role_batch_burst)
+        self.scheduler = CommandScheduler(self.loop,
+                                          self.config.max_concurrent_commands)
+        self.background_tasks = list()
+        self.db_connect_task = None
+        self.snapshot_load_task = None
+        self.metrics_server = None
+        self.watchdog = None
+        self.profiler = profiling.CommandProfiler(
+            self.config.profile_directory)
+        async_db.init(self.config)
+        self.register_metrics()
 
     def run(self):
         super().run(self.config.bot_token)
 
+    async def start(self, *args, **kwargs):
+        # The database connection is opened and the member snapshot read
+        # while logging in to Discord, so that none waits for the others
+        self.db_connect_task = self.loop.create_task(self.connect_db())
+        if self.member_snapshot is not None:
+            self.snapshot_load_task = self.loop.create_task(
+                self.load_member_snapshot())
+        await super().start(*args, **kwargs)
+
+    async def close(self):
+        self.scheduler.cancel_all()
+        # The watchdog would report the stopped loop as blocked
+        if self.watchdog is not None:
+            self.watchdog.stop()
+        for task in self.background_tasks:
+            task.cancel()
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
+        await super().close()
+        if self.member_snapshot is not None:
+            self.member_snapshot.flush()
+            self.member_snapshot.close()
+
+    async def connect_db(self):
+        logger = logging.getLogger("haruhichanbot")
+        start = time.perf_counter()
+        try:
+            await async_db.connect(self.config.sql_infos['create_tables'])
+        except Exception as e:
+            # Commands using the database fail until it is reachable,
+            # the others keep working
+            logger.error(f"Could not connect to the database: {e}")
+            return
+        logger.info("Connected to the database in {0:.2f}s".format(
+            time.perf_counter() - start))
+        try:
+            self.role_menus = {
+                int(message_id): (int(guild_id), int(channel_id))
+                for message_id, guild_id, channel_id
+                in await async_db.get_role_menus()}
+        except Exception as e:
+            logger.error(f"Could not load the role menus: {e}")
+
+    async def load_member_snapshot(self):
+        """Fills the users cache with the user names saved before restarting"""
+        logger = logging.getLogger("haruhichanbot")
+        try:
+            user_names = await self.loop.run_in_executor(
+                None, self.member_snapshot.load, self.config.users_cache_size)
+        except sqlite3.Error as e:
+            logger.error(f"Could not load the member snapshot: {e}")
+            return
+        for user_id, user_name in user_names:
+            self.users_cache.set(user_id, user_name)
+        logger.info(f"Loaded {len(user_names)} user names from the snapshot")
+
     def _prettify_docstring(self, docstring):
         """
         Returns a docstring with clean indentation and
@@ -33,47 +145,453 @@ class HaruhiChanBot(discord.Client):
                                                     self.config.command_prefix)
         return pretty_docstring
 
+    def render_help_texts(self):
+        """
+        Renders every help reply once, so that they cost nothing per message
+        Called at startup and each time the commands settings change
+        """
+        help_msg = ["```", "HaruhiChanBot commands:"]
+        for cmd in self.commands:
+            help_msg.append("\t- {prefix}{cmd_name}: {desc}".format(
+                prefix=self.config.command_prefix,
+                cmd_name=cmd.name,
+                desc=cmd.summary))
+        help_msg.append("```")
+
+        help_texts = {
+            "commands": '\n'.join(help_msg),
+            "accounts": self._render_accounts_infos(self.cmd_cfg),
+            "roles": self._render_assignable_roles(self.cmd_cfg),
+            "role_menu": self._render_role_menu(self.cmd_cfg),
+            "usages": dict()
+        }
+        for cmd in self.commands:
+            usage = "```{0}```".format(self._prettify_docstring(cmd.doc))
+            if cmd.help_infos:
+                usage += "\n" + help_texts[cmd.help_infos]
+            help_texts["usages"][cmd.name] = usage
+        # Replaced at once so that commands never see partial renderings
+        self.help_texts = help_texts
+
+    def get_help(self, cmd_name):
+        """Returns the rendered help reply of a command"""
+        return self.help_texts["usages"][cmd_name]
+
+    def register_metrics(self):
+        """Registers the metrics read from the client state"""
+        def cache_stats(stat):
+            caches = {"users": self.users_cache,
+                      "accounts": db_manager.accounts_cache}
+            return {(name,): getattr(cache, stat)
+                    for name, cache in caches.items() if cache is not None}
+
+        metrics.registry.callback(
+            "haruhichanbot_cache_hits_total", "Cache hits, by cache",
+            "counter", lambda: cache_stats("hits"), ("cache",))
+        metrics.registry.callback(
+            "haruhichanbot_cache_misses_total", "Cache misses, by cache",
+            "counter", lambda: cache_stats("misses"), ("cache",))
+        metrics.registry.callback(
+            "haruhichanbot_send_queue_depth",
+            "Messages waiting to be sent", "gauge",
+            lambda: self.send_queue.depth)
+        metrics.registry.callback(
+            "haruhichanbot_commands_queued",
+            "Commands waiting for a previous command of their user " +
+            "or for a free slot", "gauge",
+            lambda: self.scheduler.queued)
+        metrics.registry.callback(
+            "haruhichanbot_commands_in_flight",
+            "Commands running", "gauge",
+            lambda: self.scheduler.in_flight)
+        metrics.registry.callback(
+            "haruhichanbot_role_batch_depth",
+            "Member role changes of mass_role waiting", "gauge",
+            lambda: self.role_batch_queue.depth)
+        metrics.registry.callback(
+            "haruhichanbot_gateway_latency_seconds",
+            "Average latency of the gateway heartbeats", "gauge",
+            lambda: self.latency)
+        metrics.registry.callback(
+            "haruhichanbot_guilds", "Guilds the client is in", "gauge",
+            lambda: len(self.guilds))
+
     async def on_ready(self):
         logger = logging.getLogger("haruhichanbot")
         logger.info("HaruhiChanBot successfully connected.")
+        # on_ready is also called after reconnections
+        if not self.background_tasks:
+            await self.start_background_tasks()
+
+    async def start_background_tasks(self):
+        self.background_tasks.append(
+            self.loop.create_task(metrics.monitor_event_loop_lag()))
+        if self.config.commands_settings_poll_interval > 0:
+            self.background_tasks.append(
+                self.loop.create_task(self.watch_commands_config()))
+        if self.member_snapshot is not None:
+            self.background_tasks.append(self.loop.create_task(
+                self.member_snapshot.flush_periodically(
+                    self.config.member_snapshot_flush_interval)))
+        # Registered by a single worker when the shards are spread
+        if self.config.slash_commands_enabled and (
+                self.shard_ids is None or 0 in self.shard_ids):
+            self.background_tasks.append(self.loop.create_task(
+                self.register_application_commands()))
+        if self.config.watchdog_threshold > 0:
+            self.watchdog = profiling.LoopWatchdog(
+                self.loop, self.config.watchdog_threshold)
+            self.watchdog.start()
+        if self.config.metrics_enabled:
+            # Each worker process serves its own metrics
+            port = self.config.metrics_port + self.worker_index
+            self.metrics_server = metrics.MetricsServer(
+                self.config.metrics_host, port)
+            try:
+                await self.metrics_server.start()
+            except OSError as e:
+                logger = logging.getLogger("haruhichanbot")
+                logger.error(f"Could not serve the metrics: {e}")
+                self.metrics_server = None
+
+    async def on_guild_available(self, guild):
+        self.role_cache.populate(guild)
+        if self.member_snapshot is not None:
+            for member in guild.members:
+                self.member_snapshot.update_member(member)
+
+    async def on_guild_join(self, guild):
+        self.role_cache.populate(guild)
+
+    async def on_guild_remove(self, guild):
+        self.role_cache.remove_guild(guild)
+
+    async def on_member_join(self, member):
+        if self.member_snapshot is not None:
+            self.member_snapshot.update_member(member)
+
+    async def on_member_update(self, before, after):
+        if self.member_snapshot is not None:
+            self.member_snapshot.update_member(after)
+
+    async def on_member_remove(self, member):
+        if self.member_snapshot is not None:
+            self.member_snapshot.remove(member.guild.id, member.id)
+
+    async def on_user_update(self, before, after):
+        self.users_cache.invalidate(after.id)
+        if self.member_snapshot is not None:
+            for guild in self.guilds:
+                member = guild.get_member(after.id)
+                if member is not None:
+                    self.member_snapshot.update_member(member)
+
+    async def on_guild_role_update(self, before, after):
+        self.role_cache.update_role(after)
+
+    async def on_guild_role_delete(self, role):
+        self.role_cache.remove_role(role)
+
+    async def on_raw_reaction_add(self, payload):
+        await self.apply_reaction_role(payload, add=True)
+
+    async def on_raw_reaction_remove(self, payload):
+        await self.apply_reaction_role(payload, add=False)
+
+    async def on_raw_message_delete(self, payload):
+        if self.role_menus.pop(payload.message_id, None) is not None:
+            await async_db.remove_role_menu(str(payload.message_id))
+
+    async def apply_reaction_role(self, payload, add):
+        """
+        Adds or removes the role of a reaction on a role menu
+        Only uses the event and the caches: neither the message
+        nor the member are fetched, and nothing is replied
+        The command rate limits don't apply: a dropped change would leave
+        the reaction on the menu without the role
+        """
+        if (payload.message_id not in self.role_menus or
+                payload.user_id == self.user.id):
+            return
+        emoji_key = (str(payload.emoji.id) if payload.emoji.id
+                     else payload.emoji.name)
+        role_name = self.cmd_cfg.emoji_roles.get(emoji_key)
+        guild = self.get_guild(payload.guild_id)
+        if role_name is None or guild is None:
+            return
+
+        logger = logging.getLogger("haruhichanbot")
+        try:
+            role = self.role_cache.get(guild, role_name)
+            if add:
+                with metrics.rest_call_seconds.time(("add_role",)):
+                    await self.http.add_role(guild.id, payload.user_id,
+                                             role.id)
+            else:
+                with metrics.rest_call_seconds.time(("remove_role",)):
+                    await self.http.remove_role(guild.id, payload.user_id,
+                                                role.id)
+        except exceptions.InvalidRoleException:
+            pass
+        except discord.HTTPException as e:
+            logger.error(f"Could not change role {role_name} of " +
+                         f"{payload.user_id} from a reaction: {e}")
+
+    async def reload_commands_config(self):
+        """
+        Parses the commands settings file off the event loop,
+        validates it and swaps it with the current settings
+        Commands in progress keep the settings they started with
+        Raises exceptions.InvalidCommandsConfigException if invalid
+        """
+        cmd_cfg = await self.loop.run_in_executor(
+            None, CommandsConfig, self.cmd_cfg.json_cfg_file)
+        self.cmd_cfg = cmd_cfg
+        self.role_cache.set_roles_config(cmd_cfg.roles)
+        for guild in self.guilds:
+            self.role_cache.populate(guild)
+        self.render_help_texts()
+        if self.role_menus:
+            self.role_menus_task = self.loop.create_task(
+                self.update_role_menus())
+        logger = logging.getLogger("haruhichanbot")
+        logger.info(f"Reloaded commands settings {cmd_cfg.json_cfg_file}")
+
+    async def update_role_menus(self):
+        """
+        Edits the role menus after the roles changed, and adds
+        the reactions of the new roles, without fetching the messages
+        """
+        logger = logging.getLogger("haruhichanbot")
+        for message_id, (guild_id, channel_id) in list(
+                self.role_menus.items()):
+            try:
+                with metrics.rest_call_seconds.time(("edit_message",)):
+                    await self.http.edit_message(
+                        channel_id, message_id,
+                        content=self.help_texts["role_menu"])
+                for emoji in self.cmd_cfg.role_emojis.values():
+                    with metrics.rest_call_seconds.time(("add_reaction",)):
+                        await self.http.add_reaction(channel_id, message_id,
+                                                     emoji)
+            except discord.HTTPException as e:
+                logger.error(f"Could not update role menu {message_id}: {e}")
+
+    async def watch_commands_config(self):
+        """Reloads the commands settings each time the file is modified"""
+        logger = logging.getLogger("haruhichanbot")
+        last_mtime = None
+        while not self.is_closed():
+            try:
+                mtime = os.stat(self.cmd_cfg.json_cfg_file).st_mtime
+            except OSError as e:
+                logger.error(f"Could not check commands settings: {e}")
+                mtime = last_mtime
+            if last_mtime is not None and mtime != last_mtime:
+                try:
+                    await self.reload_commands_config()
+                except (OSError, ValueError,
+                        exceptions.InvalidCommandsConfigException) as e:
+                    # Keeps the current settings until the file is fixed
+                    logger.error(f"Could not reload commands settings: {e}")
+                except Exception:
+                    # Keeps watching the file whatever went wrong
+                    logger.exception("Could not reload commands settings")
+            last_mtime = mtime
+            await asyncio.sleep(self.config.commands_settings_poll_interval)
 
     async def on_message(self, message):
+        # Without prefix commands, messages don't need to be inspected
+        if not self.config.prefix_commands_enabled:
+            return
         await self.wait_until_ready()
+        self.dispatch_command(message)
 
+    def dispatch_command(self, message):
+        """
+        Parses and checks the command of a message, and schedules it
+        Returns the task running the command, or None
+        """
         if message.author == self.user:
             return
 
         message_content = message.content.strip()
         if not message_content.startswith(self.config.command_prefix):
             return
+        start = time.perf_counter()
 
         command, *args = message_content.split()
         command = command[len(self.config.command_prefix):].lower()
 
-        try:
-            handler = getattr(self, "cmd_" + command)
-        except AttributeError:
+        if not self.check_rate_limits(message, command):
+            logger = logging.getLogger("haruhichanbot")
+            logger.debug("Rate limited: {0}\nOriginal message: {1}".format(
+                message.author.id, message_content))
+            return
+
+        cmd = self.commands.get(command)
+        if cmd is None:
             logger = logging.getLogger("haruhichanbot")
             logger.debug("Invalid command: {0}\nOriginal message: {1}".format(
                 command, message_content))
-            await message.channel.send(
+            self.send_queue.enqueue(
+                message.channel,
                 "Invalid command, see {0}help for a list of commands".format(
                     self.config.command_prefix))
             return
+        error = self.check_command(cmd, message)
+        if error:
+            self.send_queue.enqueue(message.channel, error)
+            return
 
-        params = inspect.signature(handler).parameters.copy()
+        def reply(content):
+            self.send_queue.enqueue(message.channel, content)
+
+        return self.scheduler.submit(
+            message.author.id,
+            self.run_command(cmd, message, args, start,
+                             time.perf_counter(), reply),
+            cmd.timeout or self.config.command_timeout,
+            lambda: reply("The command took too long and was cancelled."))
+
+    def check_command(self, cmd, message):
+        """Returns why the author of message can't use cmd, or None"""
+        if not cmd.is_allowed(message.author):
+            return "This command is reserved to administrators."
+        if cmd.guild_only and message.guild is None:
+            return "This command can only be used in a server."
+        return None
+
+    async def on_socket_response(self, msg):
+        # Interactions are not supported by this version of discord.py,
+        # they are read from the raw gateway events
+        if (msg.get("t") == "INTERACTION_CREATE" and
+                self.config.slash_commands_enabled and
+                msg["d"].get("type") == interactions.APPLICATION_COMMAND):
+            await self.handle_interaction(msg["d"])
+
+    async def handle_interaction(self, interaction):
+        """
+        Runs the command of an application command interaction
+        The response is deferred if the command isn't done after
+        DeferDelay seconds, and edited with its replies once it is
+        """
+        start = time.perf_counter()
+        message = interactions.InteractionMessage(self, interaction)
+        cmd = self.commands.get(message.command_name)
+        if cmd is None:
+            error = "Unknown command."
+        elif not self.check_rate_limits(message, cmd.name):
+            error = "Too many commands, please wait a bit."
+        else:
+            error = self.check_command(cmd, message)
 
-        handler_kwargs = {}
-        if params.pop('user_id', None):
-            handler_kwargs['user_id'] = message.author.id
-        if params.pop('user', None):
-            handler_kwargs['user'] = message.author
-        if params.pop('cmd_args', None):
-            handler_kwargs['cmd_args'] = args
+        logger = logging.getLogger("haruhichanbot")
+        if error:
+            try:
+                await interactions.respond(
+                    self.http, interaction, interactions.CHANNEL_MESSAGE,
+                    error, ephemeral=True)
+            except discord.HTTPException as e:
+                logger.error(f"Could not respond to an interaction: {e}")
+            return
 
-        response = await handler(**handler_kwargs)
-        if response:
-            await message.channel.send(response)
+        replies = list()
+        task = self.scheduler.submit(
+            message.author.id,
+            self.run_command(cmd, message, message.args, start,
+                             time.perf_counter(), replies.append),
+            cmd.timeout or self.config.command_timeout,
+            lambda: replies.append(
+                "The command took too long and was cancelled."))
+
+        try:
+            deferred = False
+            done, pending = await asyncio.wait(
+                {task}, timeout=self.config.slash_commands_defer_delay)
+            if pending:
+                # Must be acknowledged within 3 seconds
+                await interactions.respond(
+                    self.http, interaction,
+                    interactions.DEFERRED_CHANNEL_MESSAGE)
+                deferred = True
+                await asyncio.wait({task})
+
+            if not replies:
+                failed = task.cancelled() or task.exception() is not None
+                replies.append("An unknown error happened, please contact " +
+                               "administrator." if failed else "Done.")
+            if deferred:
+                await interactions.edit_original(self.http, interaction,
+                                                 replies[0])
+            else:
+                await interactions.respond(
+                    self.http, interaction, interactions.CHANNEL_MESSAGE,
+                    replies[0])
+            for content in replies[1:]:
+                await interactions.follow_up(self.http, interaction, content)
+        except discord.HTTPException as e:
+            logger.error(f"Could not respond to an interaction: {e}")
+
+    async def register_application_commands(self):
+        """Registers the commands of the registry as application commands"""
+        logger = logging.getLogger("haruhichanbot")
+        application_commands = interactions.build_application_commands(
+            self.commands)
+        try:
+            app_info = await self.application_info()
+            await interactions.register_commands(self.http, app_info.id,
+                                                 application_commands)
+        except discord.HTTPException as e:
+            logger.error(f"Could not register the application commands: {e}")
+            return
+        logger.info(f"Registered {len(application_commands)} " +
+                    "application commands")
+
+    async def run_command(self, cmd, message, args, start, parsed, reply):
+        """Runs a command handler and gives its replies to reply()"""
+        timings = {"parse": parsed - start,
+                   "queue": time.perf_counter() - parsed}
+        profiling.current_timings.set(timings)
+        metrics.commands_total.inc((cmd.name,))
+        with metrics.command_seconds.time((cmd.name,)), \
+                self.profiler.profile(cmd.name):
+            response = await cmd.handler(self, **cmd.bind(message, args))
+            if isinstance(response, str):
+                if response:
+                    reply(response)
+            elif response is not None:
+                # Streamed responses are replied as soon as each message
+                # is ready
+                async for msg in response:
+                    reply(msg)
+
+        duration = time.perf_counter() - start
+        if duration > self.config.slow_command_threshold:
+            logger = logging.getLogger("haruhichanbot")
+            logger.warning(
+                "Slow command {0}: {1:.3f}s ({2})\nArgs={3}".format(
+                    cmd.name, duration,
+                    ", ".join(f"{name}: {seconds:.3f}s"
+                              for name, seconds in timings.items()),
+                    args))
+
+    def check_rate_limits(self, message, command):
+        """
+        Returns whether the command can be run now
+        regarding the user, channel and command limits
+        Tokens are only consumed if every limit allows the command
+        """
+        keys = {"user": message.author.id,
+                "channel": message.channel.id,
+                "command": (message.author.id, command)}
+        limits = [(limiter, keys[scope])
+                  for scope, limiter in self.rate_limiters.items()]
+        if not all(limiter.has_token(key) for limiter, key in limits):
+            return False
+        for limiter, key in limits:
+            limiter.consume(key)
+        return True
 
     async def cmd_help(self):
         """
@@ -82,19 +600,95 @@ class HaruhiChanBot(discord.Client):
         Usage:
             {command_prefix}help
         """
-        commands = inspect.getmembers(self, predicate=inspect.ismethod)
-        commands = [cmd for cmd in commands if cmd[0].startswith("cmd_")]
+        return self.help_texts["commands"]
 
-        help_msg = ["```", "HaruhiChanBot commands:"]
-        for cmd_name, cmd_method in commands:
-            # Gets the first relevant line of the docstring of the method
-            doc = cmd_method.__doc__.split('\n')[1].strip()
-            help_msg.append("\t- {prefix}{cmd_name}: {desc}".format(
-                prefix=self.config.command_prefix,
-                cmd_name=cmd_name[4:],
-                desc=doc))
-        help_msg.append("```")
-        return '\n'.join(help_msg)
+    @command(admin_only=True)
+    async def cmd_reload_settings(self):
+        """
+        Reloads the commands settings file (administrators only)
+
+        Usage:
+            {command_prefix}reload_settings
+        """
+        try:
+            await self.reload_commands_config()
+        except (OSError, ValueError,
+                exceptions.InvalidCommandsConfigException) as e:
+            return f"Settings not reloaded, the file is invalid:\n```{e}```"
+        return "Settings successfully reloaded."
+
+    @command(admin_only=True)
+    async def cmd_clear_cache(self):
+        """
+        Forgets the cached accounts (administrators only)
+        Run it after importing accounts from the command line
+
+        Usage:
+            {command_prefix}clear_cache
+        """
+        if db_manager.accounts_cache is not None:
+            db_manager.accounts_cache.clear()
+        return "Accounts cache cleared."
+
+    @command(admin_only=True, guild_only=True, timeout=600)
+    async def cmd_import_accounts(self, guild_id, attachments):
+        """
+        Imports the accounts of the attached file (administrators only)
+
+        Usage:
+            {command_prefix}import_accounts, with a .csv, .json or .jsonl file
+            The file has the fields discord_user_id, account_source,
+            account_server (if applicable), account_name and comment (optional)
+            The accounts are imported in this server
+        """
+        if len(attachments) != 1:
+            return ("Please attach exactly one file.\n" +
+                    self.get_help("import_accounts"))
+        # Rarely used, only loaded when needed
+        from . import bulk_accounts
+
+        try:
+            data = await attachments[0].read()
+            nb_read, nb_inserted, errors = await async_db.run(
+                bulk_accounts.import_accounts_data, data,
+                attachments[0].filename, self.cmd_cfg, guild_id)
+        except (ValueError, discord.HTTPException) as e:
+            return f"Could not read the file: {e}"
+        except Exception as e:
+            logger = logging.getLogger("haruhichanbot")
+            logger.error("Exception in cmd_import_accounts\n" +
+                         "Msg={0}".format(e))
+            return "An unknown error happened, please contact administrator."
+
+        msg = (f"{nb_inserted} account(s) imported, " +
+               f"{nb_read - nb_inserted} already registered.")
+        if errors:
+            msg += f"\n{len(errors)} invalid row(s):```"
+            msg += "\n".join(errors[:10])
+            if len(errors) > 10:
+                msg += "\n..."
+            msg += "```"
+        return msg
+
+    @command(admin_only=True)
+    async def cmd_profile(self, cmd_args):
+        """
+        Profiles the next commands handled (administrators only)
+
+        Usage:
+            {command_prefix}profile nb_commands
+        """
+        try:
+            nb_commands = int(cmd_args[0]) if len(cmd_args) == 1 else None
+        except ValueError:
+            nb_commands = None
+        if not nb_commands or nb_commands < 0:
+            return ("Invalid argument: please provide a positive integer\n" +
+                    self.get_help("profile"))
+
+        self.profiler.enable(nb_commands)
+        return (f"Profiling the next {nb_commands} command(s), reports " +
+                f"will be written in `{self.config.profile_directory}`.")
 
     async def cmd_random(self, cmd_args):
         """
@@ -148,7 +742,8 @@ class HaruhiChanBot(discord.Client):
             return "Heads!"
         return "Tails!"
 
-    async def cmd_register_account(self, user_id, cmd_args):
+    @command(guild_only=True, help_infos="accounts")
+    async def cmd_register_account(self, guild_id, user_id, cmd_args):
         """
         Register a game or website account and link it to your profile on this server
 
@@ -156,16 +751,11 @@ class HaruhiChanBot(discord.Client):
             {command_prefix}register_account game_or_website [server] name_or_id
             Ex: {command_prefix}register_account azurlane sandy 123123123
         """
-        async def help(self):
-            msg = "```{0}```\n{1}".format(
-                self._prettify_docstring(self.cmd_register_account.__doc__),
-                await self.get_register_accounts_infos())
-            return msg
-
         if len(cmd_args) == 1 and cmd_args[0] == "help":
-            return await help(self)
+            return self.get_help("register_account")
         if len(cmd_args) <= 1 or len(cmd_args) > 3:
-            return "Invalid number of arguments.\n" + await help(self)
+            return ("Invalid number of arguments.\n" +
+                    self.get_help("register_account"))
 
         input_acc_server = cmd_args[1].lower() if len(cmd_args) == 3 else None
 
@@ -181,7 +771,8 @@ class HaruhiChanBot(discord.Client):
 
         account_name = cmd_args[-1]
         try:
-            db_manager.insert_user_account(
+            await async_db.insert_user_account(
+                discord_guild_id=guild_id,
                 discord_user_id=user_id,
                 account_source=acc_source,
                 account_server=acc_server,
@@ -199,7 +790,7 @@ class HaruhiChanBot(discord.Client):
             msg += f"(server: `{acc_server}`) "
         return msg + " successfully added."
 
-    async def get_register_accounts_infos(self):
+    def _render_accounts_infos(self, cmd_cfg):
         """
         Returns a human-readable string of all games & website,
         their aliases and their servers if applicable.
@@ -207,7 +798,7 @@ class HaruhiChanBot(discord.Client):
         msg = list()
         msg.append("```Game/Website (aliases): Servers")
 
-        for source, source_infos in (self.cmd_cfg.account_sources.items()):
+        for source, source_infos in (cmd_cfg.account_sources.items()):
             if source_infos["servers"]:
                 servs = ", ".join(source_infos["servers"])
             else:
@@ -235,7 +826,9 @@ class HaruhiChanBot(discord.Client):
             acc_source, source_infos = self.cmd_cfg.get_account_source_infos(
                 input_acc_source)
         except exceptions.NoAccountSourceInfosException:
-            raise exceptions.AccountSourceNotFoundException(input_acc_source)
+            raise exceptions.AccountSourceNotFoundException(
+                input_acc_source,
+                self.cmd_cfg.suggest_account_sources(input_acc_source))
 
         if source_infos["servers"] is None and input_acc_server:
             raise exceptions.AccountHasNoServerWarning()
@@ -246,15 +839,15 @@ class HaruhiChanBot(discord.Client):
         account_server = None
         if input_acc_server:
             account_server = input_acc_server.lower()
-            if (account_server not in
-                    [x.lower() for x in source_infos["servers"]]):
+            if not self.cmd_cfg.is_valid_server(acc_source, account_server):
                 acc_servers = ", ".join(source_infos["servers"])
                 raise exceptions.InvalidAccountServerException(
                     input_acc_server, acc_source, acc_servers)
 
         return acc_source, account_server
 
-    async def cmd_list_self_accounts(self, user_id):
+    @command(guild_only=True)
+    async def cmd_list_self_accounts(self, guild_id, user_id):
         """
         Lists account that belongs to your profile on this server
 
@@ -262,7 +855,7 @@ class HaruhiChanBot(discord.Client):
             {command_prefix}list_self_accounts
         """
 
-        accounts = db_manager.get_accounts_for_user(user_id)
+        accounts = await async_db.get_accounts_for_user(guild_id, user_id)
         if not accounts:
             return "You have no accounts registered on this server."
 
@@ -279,25 +872,33 @@ class HaruhiChanBot(discord.Client):
         msg.append("```")
         return "\n".join(msg)
 
-    async def cmd_list_accounts(self, user_id, cmd_args):
+    @command(guild_only=True, help_infos="accounts", timeout=300)
+    async def cmd_list_accounts(self, guild, cmd_args):
         """
         Lists account for a specific source and optionally server
 
         Usage:
-            {command_prefix}list_accounts acc_source [acc_server]
+            {command_prefix}list_accounts acc_source [acc_server] [#page]
             Ex: {command_prefix}list_accounts azurlane sandy
+            Ex: {command_prefix}list_accounts azurlane #2
         """
 
-        async def help(self):
-            msg = "```{0}```\n{1}".format(
-                self._prettify_docstring(self.cmd_list_accounts.__doc__),
-                await self.get_register_accounts_infos())
-            return msg
-
         if len(cmd_args) == 1 and cmd_args[0] == "help":
-            return await help(self)
+            return self.get_help("list_accounts")
+
+        page = 1
+        if cmd_args and cmd_args[-1].startswith("#"):
+            try:
+                page = int(cmd_args[-1][1:])
+                if page < 1:
+                    raise ValueError
+            except ValueError:
+                return "Invalid page: please use `#` and a positive integer"
+            cmd_args = cmd_args[:-1]
+
         if len(cmd_args) < 1 or len(cmd_args) > 2:
-            return "Invalid number of arguments.\n" + await help(self)
+            return ("Invalid number of arguments.\n" +
+                    self.get_help("list_accounts"))
 
         input_acc_server = cmd_args[1].lower() if len(cmd_args) == 2 else None
         try:
@@ -309,35 +910,138 @@ class HaruhiChanBot(discord.Client):
                 exceptions.InvalidAccountServerException) as e:
             return str(e)
 
-        accounts = db_manager.get_accounts_for_source_and_server(
+        nb_accounts = await async_db.count_accounts_for_source_and_server(
+            discord_guild_id=guild.id,
             account_source=acc_source,
             account_server=acc_server)
 
-        if not accounts:
+        if not nb_accounts:
             msg = f"No accounts for {acc_source}"
             if len(cmd_args) == 2:
                 msg += f" in server {acc_server}"
             return msg
 
-        users_cache = dict()
-        msg = list()
-        msg.append(f"Accounts for {acc_source}:```")
+        page_size = self.config.list_page_size
+        nb_pages = -(-nb_accounts // page_size)
+        if page > nb_pages:
+            return f"Invalid page: there are {nb_pages} page(s)."
+
+        header = f"Accounts for {acc_source}:"
+        if nb_pages > 1:
+            header = f"Accounts for {acc_source} (page {page}/{nb_pages}):"
+        return self._stream_accounts_listing(
+            guild, header, acc_source, acc_server, page, nb_pages,
+            " ".join(cmd_args))
+
+    async def _stream_accounts_listing(self, guild, header,
+                                       acc_source, acc_server,
+                                       page, nb_pages, input_args):
+        """
+        Yields the messages of one page of cmd_list_accounts
+        Only one batch of accounts is held in memory at a time
+        """
+        async for msg in pack_lines(
+                self._iter_accounts_lines(guild, acc_source, acc_server,
+                                          page),
+                header=header):
+            yield msg
+
+        if page < nb_pages:
+            yield ("Use `{prefix}list_accounts {args} #{next_page}` " +
+                   "for the next page.").format(
+                       prefix=self.config.command_prefix,
+                       args=input_args, next_page=page + 1)
+
+    async def _iter_accounts_lines(self, guild, acc_source, acc_server, page):
+        """
+        Yields the lines of one page of cmd_list_accounts,
+        reading the accounts from the database batch by batch
+        """
+        offset = (page - 1) * self.config.list_page_size
+        remaining = self.config.list_page_size
+        after = None
         prev_server = None
-        for account in accounts:
-            if account.discord_user_id not in users_cache:
-                users_cache[account.discord_user_id] = await self.fetch_user(
-                    account.discord_user_id)
-            if account.account_server != prev_server:
-                msg.append(f"--- Server {account.account_server} ---")
-                prev_server = account.account_server
-            msg.append("{discord_user}: {acc}".format(
-                discord_user=users_cache[account.discord_user_id],
-                acc=account.account_name))
-
-        msg.append("```")
-        return "\n".join(msg)
-
-    async def cmd_remove_all_accounts(self, user_id, cmd_args):
+        while remaining > 0:
+            accounts = await async_db.get_accounts_for_source_and_server(
+                discord_guild_id=guild.id,
+                account_source=acc_source,
+                account_server=acc_server,
+                offset=offset,
+                after=after,
+                limit=min(self.config.list_batch_size, remaining))
+            if not accounts:
+                return
+            # Only the first batch skips the previous pages, the next
+            # ones start after the last account read
+            offset = 0
+            last = accounts[-1]
+            after = (last.account_server, last.account_name, last.account_id)
+            remaining -= len(accounts)
+
+            user_names = await self.get_user_names(
+                guild, [account.discord_user_id for account in accounts])
+            for account in accounts:
+                if account.account_server != prev_server:
+                    yield f"--- Server {account.account_server} ---"
+                    prev_server = account.account_server
+                yield "{discord_user}: {acc}".format(
+                    discord_user=user_names[int(account.discord_user_id)],
+                    acc=account.account_name)
+
+    async def get_user_names(self, guild, user_ids):
+        """
+        Returns a dict of Discord user ID -> user name
+        Looks in the users cache then in the gateway cache,
+        and fetches the remaining users concurrently, waiting for
+        the fetches already in progress rather than starting new ones
+        """
+        user_names = dict()
+        missing_ids = list()
+        for user_id in {int(user_id) for user_id in user_ids}:
+            user_name = self.users_cache.get(user_id)
+            if user_name is None:
+                user = self.get_user(user_id)
+                if user is None and guild is not None:
+                    user = guild.get_member(user_id)
+                if user is None:
+                    missing_ids.append(user_id)
+                    continue
+                user_name = str(user)
+                self.users_cache.set(user_id, user_name)
+            user_names[user_id] = user_name
+
+        fetches = list()
+        for user_id in missing_ids:
+            fetch = self.user_fetches.get(user_id)
+            if fetch is None:
+                fetch = self.user_fetches[user_id] = self.loop.create_task(
+                    self._fetch_user_name(guild, user_id))
+                fetch.add_done_callback(
+                    lambda fetch, user_id=user_id:
+                        self.user_fetches.pop(user_id, None))
+            # A cancelled listing doesn't cancel the fetches of the others
+            fetches.append(asyncio.shield(fetch))
+        fetched_names = await asyncio.gather(*fetches)
+        user_names.update(zip(missing_ids, fetched_names))
+        return user_names
+
+    async def _fetch_user_name(self, guild, user_id):
+        async with self.fetch_user_semaphore:
+            try:
+                with metrics.rest_call_seconds.time(("fetch_user",)), \
+                        profiling.phase("rest"):
+                    user = await self.fetch_user(user_id)
+            except discord.HTTPException as e:
+                logger = logging.getLogger("haruhichanbot")
+                logger.warning(f"Could not fetch user {user_id}: {e}")
+                return f"Unknown user ({user_id})"
+        self.users_cache.set(user_id, str(user))
+        if self.member_snapshot is not None and guild is not None:
+            self.member_snapshot.update_name(guild.id, user_id, str(user))
+        return str(user)
+
+    @command(guild_only=True, help_infos="accounts")
+    async def cmd_remove_all_accounts(self, guild_id, user_id, cmd_args):
         """
         Removes all accounts linked to your profile from the game/website/server you entered
 
@@ -345,14 +1049,9 @@ class HaruhiChanBot(discord.Client):
             {command_prefix}remove_all_accounts acc_source [acc_server]
             Ex: {command_prefix}remove_all_accounts azurlane sandy
         """
-        async def help(self):
-            msg = "```{0}```\n{1}".format(
-                self._prettify_docstring(self.cmd_remove_all_accounts.__doc__),
-                await self.get_register_accounts_infos())
-            return msg
-
         if len(cmd_args) < 1 or len(cmd_args) > 2:
-            return "Invalid number of arguments.\n" + await help(self)
+            return ("Invalid number of arguments.\n" +
+                    self.get_help("remove_all_accounts"))
 
         input_acc_server = cmd_args[1].lower() if len(cmd_args) == 2 else None
 
@@ -366,27 +1065,25 @@ class HaruhiChanBot(discord.Client):
                 exceptions.InvalidAccountServerException) as e:
             return str(e)
 
-        nb_removed = db_manager.remove_server_accounts_for_user(
+        nb_removed = await async_db.remove_server_accounts_for_user(
+            discord_guild_id=guild_id,
             discord_user_id=user_id,
             account_source=acc_source,
             account_server=acc_server)
         return f"{nb_removed} account(s) successfully deleted."
 
-    async def cmd_remove_account(self, user_id, cmd_args):
+    @command(guild_only=True)
+    async def cmd_remove_account(self, guild_id, user_id, cmd_args):
         """
         Removes one specific account linked to your profile.
 
         Usage:
-            {command_prefix}remove_accounts acc_source [acc_server] acc_name
-            Ex: {command_prefix}remove_all_accounts azurlane sandy yourname
+            {command_prefix}remove_account acc_source [acc_server] acc_name
+            Ex: {command_prefix}remove_account azurlane sandy yourname
         """
-        async def help(self):
-            msg = "```{0}```".format(
-                self._prettify_docstring(self.cmd_remove_account.__doc__))
-            return msg
-
         if len(cmd_args) < 2 or len(cmd_args) > 3:
-            return "Invalid number of arguments.\n" + await help(self)
+            return ("Invalid number of arguments.\n" +
+                    self.get_help("remove_account"))
 
         input_acc_server = cmd_args[1].lower() if len(cmd_args) == 3 else None
 
@@ -400,7 +1097,8 @@ class HaruhiChanBot(discord.Client):
                 exceptions.InvalidAccountServerException) as e:
             return str(e)
 
-        nb_removed = db_manager.remove_account(
+        nb_removed = await async_db.remove_account(
+            discord_guild_id=guild_id,
             discord_user_id=user_id,
             account_source=acc_source,
             account_server=acc_server,
@@ -409,36 +1107,41 @@ class HaruhiChanBot(discord.Client):
             return "Account successfully deleted."
         return "No account with this name found."
 
-    async def cmd_add_role(self, user, cmd_args):
+    @command(guild_only=True, help_infos="roles")
+    async def cmd_add_role(self, user, guild, cmd_args):
         """
-        Adds a new role to your profile on this server
+        Adds new roles to your profile on this server
 
         Usage:
-            {command_prefix}add_role new_role
-            Ex: {command_prefix}add_role azurlane
+            {command_prefix}add_role new_role [other_role...]
+            Ex: {command_prefix}add_role azurlane osu
         """
-        async def help(self):
-            msg = "```{0}```\n{1}".format(
-                self._prettify_docstring(self.cmd_add_role.__doc__),
-                await self.get_assignable_roles())
-            return msg
-
-        if len(cmd_args) != 1:
-            return "Invalid number of arguments.\n" + await help(self)
-        if cmd_args[0] == "help":
-            return await help(self)
-
-        if cmd_args[0] not in self.cmd_cfg.roles:
-            return "Unknown role `{role}`.{assignable_roles}\n".format(
-                role=cmd_args[0],
-                assignable_roles=await self.get_assignable_roles())
+        if not cmd_args:
+            return ("Invalid number of arguments.\n" +
+                    self.get_help("add_role"))
+        if cmd_args == ["help"]:
+            return self.get_help("add_role")
 
-        role = self.get_role_from_guild(user.guild, cmd_args[0])
+        try:
+            roles = self._get_roles(guild, cmd_args)
+        except exceptions.InvalidRoleException as e:
+            return str(e)
 
-        if role in user.roles:
-            return "Role already assigned."
+        # The edit below replaces every role of the member, so the roles
+        # are read now rather than from the message, which may have waited
+        # behind other commands while mass_role or a role menu changed
+        # them. Without the members intent the member isn't cached, and
+        # changes made meanwhile by these can still be reverted
+        user = guild.get_member(user.id) or user
+        new_roles = {name: role for name, role in roles.items()
+                     if role not in user.roles}
+        if not new_roles:
+            return "Role(s) already assigned."
         try:
-            await user.add_roles(role)
+            # A single member edit instead of one request per role
+            with metrics.rest_call_seconds.time(("add_roles",)), \
+                    profiling.phase("rest"):
+                await user.add_roles(*new_roles.values(), atomic=False)
         except discord.Forbidden:
             return "Invalid bot permissions. Please contact administrator."
         except Exception as e:
@@ -446,70 +1149,88 @@ class HaruhiChanBot(discord.Client):
             logger.error("Exception in cmd_add_role\n" +
                          "Msg={0}\nArgs={1}".format(e, cmd_args))
             return "An unknown error happened, please contact administrator."
-        return "Role `{0}` successfully added!".format(cmd_args[0])
+        return "{0} successfully added!".format(
+            self._format_role_names(new_roles))
+
+    def _get_roles(self, guild, role_names):
+        """
+        Returns a dict of role name -> Discord Role object in guild,
+        checking every role before any change is made
+        Raises exceptions.InvalidRoleException for an unknown role
+        """
+        role_names = list(dict.fromkeys(role_names))
+        unknown_roles = [name for name in role_names
+                         if name not in self.cmd_cfg.roles]
+        if unknown_roles:
+            raise exceptions.InvalidRoleException(
+                unknown_roles[0],
+                "Unknown role(s) {roles}.{assignable_roles}\n".format(
+                    roles=", ".join(f"`{name}`" for name in unknown_roles),
+                    assignable_roles=self.help_texts["roles"]))
+        return {name: self.role_cache.get(guild, name) for name in role_names}
+
+    def _format_role_names(self, role_names):
+        names = ", ".join(f"`{name}`" for name in role_names)
+        return f"Roles {names}" if len(role_names) > 1 else f"Role {names}"
+
+    def _render_role_menu(self, cmd_cfg):
+        """Returns the content of the role menus"""
+        msg = ["React to get a role, remove your reaction to lose it:"]
+        for role, emoji in cmd_cfg.role_emojis.items():
+            role_desc = cmd_cfg.roles[role]
+            if ":" in emoji:
+                emoji = f"<:{emoji}>"
+            msg.append("{emoji} **{title}** - {desc}".format(
+                emoji=emoji, title=role_desc["title"],
+                desc=role_desc["description"]))
+        return "\n".join(msg)
 
-    async def get_assignable_roles(self):
+    def _render_assignable_roles(self, cmd_cfg):
         """
         Returns a human-readable string of every assignable role
         with their description.
         """
         msg = list()
         msg.append("```Roles:")
-        for role, role_desc in self.cmd_cfg.roles.items():
+        for role, role_desc in cmd_cfg.roles.items():
             msg.append("\t- {role} ({title}) - {desc}".format(
                 role=role, title=role_desc["title"],
                 desc=role_desc["description"]))
         msg.append("```")
         return "\n".join(msg)
 
-    def get_role_from_guild(self, guild, role_name):
-        """
-        Returns the Discord Role object from the guild and the role's name
-        Also caches the value
-        """
-        role_desc = self.cmd_cfg.roles[role_name]
-        if "cached_discord_role" not in role_desc:
-            role = guild.get_role(role_desc["id"])
-            if not role:
-                logger = logging.getLogger("haruhichanbot")
-                logger.error(
-                    f"An invalid role {role_name} is in " +
-                    "the commands settings file.")
-                return (f"Invalid role `{role_name}`." +
-                        " Please contact administrator.")
-            role_desc["cached_discord_role"] = role
-        return role_desc["cached_discord_role"]
-
-    async def cmd_remove_role(self, user, cmd_args):
+    @command(guild_only=True, help_infos="roles")
+    async def cmd_remove_role(self, user, guild, cmd_args):
         """
-        Removes a role from your profile on this server
+        Removes roles from your profile on this server
 
         Usage:
-            {command_prefix}remove_role new_role
-            Ex: {command_prefix}remove_role azurlane
+            {command_prefix}remove_role role [other_role...]
+            Ex: {command_prefix}remove_role azurlane osu
         """
-        async def help(self):
-            msg = "```{0}```\n{1}".format(
-                self._prettify_docstring(self.cmd_remove_role.__doc__),
-                await self.get_assignable_roles())
-            return msg
-
-        if len(cmd_args) != 1:
-            return "Invalid number of arguments.\n" + await help(self)
-        if cmd_args[0] == "help":
-            return await help(self)
-
-        if cmd_args[0] not in self.cmd_cfg.roles:
-            return "Unknown role `{role}`.{assignable_roles}\n".format(
-                role=cmd_args[0],
-                assignable_roles=await self.get_assignable_roles())
+        if not cmd_args:
+            return ("Invalid number of arguments.\n" +
+                    self.get_help("remove_role"))
+        if cmd_args == ["help"]:
+            return self.get_help("remove_role")
 
-        role = self.get_role_from_guild(user.guild, cmd_args[0])
+        try:
+            roles = self._get_roles(guild, cmd_args)
+        except exceptions.InvalidRoleException as e:
+            return str(e)
 
-        if role not in user.roles:
-            return "This role is not assigned to your profile."
+        # Current roles of the member, see cmd_add_role
+        user = guild.get_member(user.id) or user
+        assigned_roles = {name: role for name, role in roles.items()
+                          if role in user.roles}
+        if not assigned_roles:
+            return "These roles are not assigned to your profile."
         try:
-            await user.remove_roles(role)
+            # A single member edit instead of one request per role
+            with metrics.rest_call_seconds.time(("remove_roles",)), \
+                    profiling.phase("rest"):
+                await user.remove_roles(*assigned_roles.values(),
+                                        atomic=False)
         except discord.Forbidden:
             return "Invalid bot permissions. Please contact administrator."
         except Exception as e:
@@ -517,4 +1238,77 @@ class HaruhiChanBot(discord.Client):
             logger.error("Exception in cmd_remove_role\n" +
                          "Msg={0}\nArgs={1}".format(e, cmd_args))
             return "An unknown error happened, please contact administrator."
-        return "Role `{0}` successfully removed!".format(cmd_args[0])
+        return "{0} successfully removed!".format(
+            self._format_role_names(assigned_roles))
+
+    @command(admin_only=True, guild_only=True)
+    async def cmd_role_menu(self, guild, channel):
+        """
+        Posts a menu giving roles by reaction (administrators only)
+
+        Usage:
+            {command_prefix}role_menu
+            The menu is updated when the commands settings are reloaded
+        """
+        if not self.cmd_cfg.role_emojis:
+            return "No role has an emoji in the commands settings."
+
+        # Sent directly, the ID of the message is needed
+        try:
+            with metrics.rest_call_seconds.time(("send_message",)):
+                menu = await channel.send(self.help_texts["role_menu"])
+            await async_db.insert_role_menu(message_id=str(menu.id),
+                                            discord_guild_id=str(guild.id),
+                                            channel_id=str(channel.id))
+            self.role_menus[menu.id] = (guild.id, channel.id)
+            for emoji in self.cmd_cfg.role_emojis.values():
+                with metrics.rest_call_seconds.time(("add_reaction",)):
+                    await menu.add_reaction(emoji)
+        except discord.Forbidden:
+            return "Invalid bot permissions. Please contact administrator."
+        except Exception as e:
+            logger = logging.getLogger("haruhichanbot")
+            logger.error("Exception in cmd_role_menu\nMsg={0}".format(e))
+            return "An unknown error happened, please contact administrator."
+
+    @command(admin_only=True, guild_only=True, help_infos="roles")
+    async def cmd_mass_role(self, guild, channel, mentions, role_mentions,
+                            cmd_args):
+        """
+        Adds or removes a role for many members (administrators only)
+        The members of the mentioned roles are also changed
+
+        Usage:
+            {command_prefix}mass_role add|remove role @member_or_role...
+            Ex: {command_prefix}mass_role add azurlane @someone @some_role
+        """
+        if len(cmd_args) < 3 or cmd_args[0] not in ("add", "remove"):
+            return "Invalid arguments.\n" + self.get_help("mass_role")
+
+        try:
+            role_name, role = self._get_roles(guild, cmd_args[1:2]).popitem()
+        except exceptions.InvalidRoleException as e:
+            return str(e)
+
+        members = {member.id: member for member in mentions
+                   if isinstance(member, discord.Member)}
+        for mentioned_role in role_mentions:
+            members.update((member.id, member)
+                           for member in mentioned_role.members)
+        if not members:
+            return "No members mentioned.\n" + self.get_help("mass_role")
+
+        change = "added to" if cmd_args[0] == "add" else "removed from"
+
+        def on_done(job):
+            self.send_queue.enqueue(
+                channel,
+                "Role `{0}` {1} {2} member(s), {3} unchanged, {4} failed."
+                .format(role_name, change, job.nb_changed, job.nb_skipped,
+                        job.nb_failed))
+
+        self.role_batch_queue.submit(
+            guild, RoleBatchJob(role, cmd_args[0] == "add",
+                                list(members.values()), on_done))
+        return "Role `{0}` will be {1} {2} member(s).".format(
+            role_name, change, len(members))
@@ -0,0 +1,136 @@
+import discord
+from discord.http import Route
+
+from . import metrics
+
+# Interaction and response types of the Discord API
+APPLICATION_COMMAND = 2
+CHANNEL_MESSAGE = 4
+DEFERRED_CHANNEL_MESSAGE = 5
+# Option type of the free text arguments
+STRING_OPTION = 3
+# Only shown to the user of the command
+EPHEMERAL = 64
+ADMINISTRATOR_PERMISSION = "8"
+# Values that can't be given through an application command
+UNSUPPORTED_INJECTABLES = {"attachments", "mentions", "role_mentions"}
+
+
+def _get_usage(cmd):
+    """
+    Returns the arguments of a command in the usage of its docstring,
+    and whether every usage line has arguments
+    """
+    prefix = "{command_prefix}" + cmd.name
+    lines = [line.strip() for line in cmd.doc.split("\n")]
+    usages = [line[len(prefix):].strip() for line in lines
+              if line == prefix or line.startswith(prefix + " ")]
+    usage = next((usage for usage in usages if usage), "")
+    return usage, bool(usages) and all(usages)
+
+
+def build_application_commands(registry):
+    """
+    Returns the application commands of every command of the registry
+    that can be used without a message, described by their docstring
+    The arguments are given as one text option, split like in a message
+    """
+    application_commands = list()
+    for cmd in registry:
+        params = {param for param, getter in cmd.injection_plan}
+        if params & UNSUPPORTED_INJECTABLES:
+            continue
+        application_command = {"name": cmd.name,
+                               "description": cmd.summary[:100] or cmd.name,
+                               "options": []}
+        if "cmd_args" in params:
+            usage, always_used = _get_usage(cmd)
+            application_command["options"].append({
+                "type": STRING_OPTION,
+                "name": "arguments",
+                "description": (usage or "Arguments")[:100],
+                "required": always_used and not usage.startswith("[")})
+        if cmd.admin_only:
+            application_command["default_member_permissions"] = \
+                ADMINISTRATOR_PERMISSION
+        if cmd.guild_only:
+            application_command["dm_permission"] = False
+        application_commands.append(application_command)
+    return application_commands
+
+
+class InteractionMessage():
+    """
+    Stand-in for the message of a command used through an interaction,
+    with everything the commands can be injected with
+    """
+
+    def __init__(self, client, interaction):
+        self.id = int(interaction["id"])
+        self.guild = None
+        if interaction.get("guild_id"):
+            self.guild = client.get_guild(int(interaction["guild_id"]))
+        channel_id = int(interaction["channel_id"])
+        self.channel = (client.get_channel(channel_id) or
+                        discord.Object(id=channel_id))
+        if self.guild is not None and "member" in interaction:
+            # Built from the interaction, the member is never fetched
+            self.author = discord.Member(data=interaction["member"],
+                                         guild=self.guild,
+                                         state=client._connection)
+        else:
+            user = interaction.get("user") or interaction["member"]["user"]
+            self.author = client._connection.store_user(user)
+        self.attachments = list()
+        self.mentions = list()
+        self.role_mentions = list()
+
+        self.command_name = interaction["data"]["name"]
+        options = {option["name"]: option.get("value", "")
+                   for option in interaction["data"].get("options", ())}
+        self.args = str(options.get("arguments", "")).split()
+
+
+async def register_commands(http, application_id, application_commands):
+    """Replaces the global application commands of the application"""
+    route = Route("PUT", "/applications/{application_id}/commands",
+                  application_id=application_id)
+    with metrics.rest_call_seconds.time(("register_commands",)):
+        await http.request(route, json=application_commands)
+
+
+async def respond(http, interaction, response_type, content=None,
+                  ephemeral=False):
+    """Sends the initial response of an interaction"""
+    route = Route("POST",
+                  "/interactions/{interaction_id}/{interaction_token}" +
+                  "/callback",
+                  interaction_id=interaction["id"],
+                  interaction_token=interaction["token"])
+    payload = {"type": response_type}
+    if content is not None:
+        payload["data"] = {"content": content}
+        if ephemeral:
+            payload["data"]["flags"] = EPHEMERAL
+    with metrics.rest_call_seconds.time(("interaction_response",)):
+        await http.request(route, json=payload)
+
+
+async def edit_original(http, interaction, content):
+    """Replaces the content of a deferred response"""
+    route = Route("PATCH",
+                  "/webhooks/{application_id}/{interaction_token}" +
+                  "/messages/@original",
+                  application_id=interaction["application_id"],
+                  interaction_token=interaction["token"])
+    with metrics.rest_call_seconds.time(("interaction_response",)):
+        await http.request(route, json={"content": content})
+
+
+async def follow_up(http, interaction, content):
+    """Sends another message in response to an interaction"""
+    route = Route("POST", "/webhooks/{application_id}/{interaction_token}",
+                  application_id=interaction["application_id"],
+                  interaction_token=interaction["token"])
+    with metrics.rest_call_seconds.time(("interaction_response",)):
+        await http.request(route, json={"content": content})
@@ -0,0 +1,108 @@
+import logging
+import multiprocessing
+import time
+
+
+def split_shards(shard_count, workers):
+    """
+    Splits the shard IDs in contiguous ranges, one per worker
+    Ex: split_shards(5, 2) -> [[0, 1, 2], [3, 4]]
+    """
+    per_worker = -(-shard_count // workers)
+    return [list(range(start, min(start + per_worker, shard_count)))
+            for start in range(0, shard_count, per_worker)]
+
+
+def run_worker(config_file, shard_ids, shard_count, worker_index,
+               worker_init=None):
+    """Runs a bot connected to the given shards, in a worker process"""
+    # Imported here so that the supervisor never loads discord.py
+    from .haruhichanbot import HaruhiChanBot
+
+    if worker_init:
+        worker_init()
+    bot = HaruhiChanBot(config_file,
+                        shard_ids=shard_ids, shard_count=shard_count,
+                        worker_index=worker_index)
+    bot.run()
+
+
+class ShardLauncher():
+    """
+    Spreads the shards over several worker processes
+    and restarts the workers that fail
+    Each worker has its own database connections and caches
+    """
+    # Seconds before restarting a failed worker, doubled each time
+    # it fails again shortly after starting
+    restart_delay = 5
+    max_restart_delay = 300
+    # A worker running this long is considered healthy again
+    healthy_uptime = 600
+
+    def __init__(self, config_file, shard_count, workers, worker_init=None):
+        self.config_file = config_file
+        self.shard_count = shard_count
+        self.worker_init = worker_init
+        self.shard_ranges = split_shards(shard_count, workers)
+        # Spawn makes every worker start from a clean interpreter
+        self._context = multiprocessing.get_context("spawn")
+        self._workers = dict()
+        # Index -> (time to restart the failed worker at, its next delay)
+        self._restarts = dict()
+
+    def _start_worker(self, index, delay):
+        shard_ids = self.shard_ranges[index]
+        process = self._context.Process(
+            target=run_worker,
+            args=(self.config_file, shard_ids, self.shard_count, index,
+                  self.worker_init),
+            name=f"haruhichanbot-shards-{shard_ids[0]}-{shard_ids[-1]}")
+        process.start()
+        self._workers[index] = (process, time.monotonic(), delay)
+
+        logger = logging.getLogger("haruhichanbot")
+        logger.info(f"Started worker {process.name} (pid {process.pid})")
+
+    def run(self):
+        """Starts every worker and supervises them until they all exit"""
+        logger = logging.getLogger("haruhichanbot")
+        for index in range(len(self.shard_ranges)):
+            self._start_worker(index, self.restart_delay)
+
+        try:
+            while self._workers or self._restarts:
+                time.sleep(1)
+                # The workers keep being checked while others wait
+                # to be restarted
+                for index, (restart_at, delay) in list(
+                        self._restarts.items()):
+                    if time.monotonic() >= restart_at:
+                        del self._restarts[index]
+                        self._start_worker(index, delay)
+
+                for index, (process, started_at, delay) in list(
+                        self._workers.items()):
+                    if process.is_alive():
+                        continue
+                    del self._workers[index]
+                    if process.exitcode == 0:
+                        logger.info(f"Worker {process.name} exited")
+                        continue
+
+                    if time.monotonic() - started_at > self.healthy_uptime:
+                        delay = self.restart_delay
+                    logger.error(
+                        f"Worker {process.name} failed " +
+                        f"(exit code {process.exitcode}), " +
+                        f"restarting in {delay} seconds")
+                    self._restarts[index] = (
+                        time.monotonic() + delay,
+                        min(delay * 2, self.max_restart_delay))
+        except KeyboardInterrupt:
+            logger.info("Stopping workers")
+        finally:
+            for process, _, _ in self._workers.values():
+                process.terminate()
+            for process, _, _ in self._workers.values():
+                process.join()
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+
+
+class MemberSnapshot():
+    """
+    Local SQLite file of the members seen by the bot
+    (guild ID, user ID) -> user name and role IDs, loaded at startup
+    so that listings don't fetch every user again after a restart
+    Updates are buffered and written in batches by flush()
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # (guild ID, user ID) -> (user name, role IDs or None to keep
+        # the stored ones), or None once removed
+        self._pending = dict()
+        self._lock = threading.Lock()
+        # Several worker processes can share the file
+        self._connection = sqlite3.connect(path, timeout=30,
+                                           check_same_thread=False)
+        with self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS members ("
+                "guild_id INTEGER NOT NULL, "
+                "user_id INTEGER NOT NULL, "
+                "user_name TEXT NOT NULL, "
+                "role_ids TEXT NOT NULL, "
+                "updated_at REAL NOT NULL, "
+                "PRIMARY KEY (guild_id, user_id))")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS ix_members_updated_at "
+                "ON members (updated_at)")
+
+    def load(self, limit):
+        """
+        Returns (user ID, user name) pairs of the limit most recently
+        updated users, the most recent last
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT user_id, user_name FROM members "
+                "GROUP BY user_id ORDER BY MAX(updated_at) DESC "
+                "LIMIT ?", (limit,)).fetchall()
+        rows.reverse()
+        return rows
+
+    def guild_ids_by_user(self):
+        """Returns a dict of user ID -> IDs of the guilds they were seen in"""
+        guild_ids = dict()
+        with self._lock:
+            for guild_id, user_id in self._connection.execute(
+                    "SELECT guild_id, user_id FROM members"):
+                guild_ids.setdefault(user_id, []).append(guild_id)
+        return guild_ids
+
+    def update(self, guild_id, user_id, user_name, role_ids=()):
+        """Buffers the current state of a member"""
+        self._pending[(guild_id, user_id)] = (
+            user_name, ",".join(str(role_id) for role_id in role_ids))
+
+    def update_name(self, guild_id, user_id, user_name):
+        """Buffers the name of a member, keeping the role IDs known"""
+        pending = self._pending.get((guild_id, user_id))
+        self._pending[(guild_id, user_id)] = (
+            user_name, pending[1] if pending is not None else None)
+
+    def update_member(self, member):
+        self.update(member.guild.id, member.id, str(member),
+                    [role.id for role in member.roles])
+
+    def remove(self, guild_id, user_id):
+        self._pending[(guild_id, user_id)] = None
+
+    def _take_pending(self):
+        # Called from the event loop thread, which buffers the updates
+        pending, self._pending = self._pending, dict()
+        return pending
+
+    def _write(self, pending):
+        now = time.time()
+        updated = [(guild_id, user_id, member[0], member[1], now)
+                   for (guild_id, user_id), member in pending.items()
+                   if member is not None and member[1] is not None]
+        renamed = [(member[0], now, guild_id, user_id)
+                   for (guild_id, user_id), member in pending.items()
+                   if member is not None and member[1] is None]
+        removed = [key for key, member in pending.items() if member is None]
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO members (guild_id, user_id, " +
+                "user_name, role_ids, updated_at) VALUES (?, ?, ?, ?, ?)",
+                updated)
+            self._connection.executemany(
+                "UPDATE members SET user_name = ?, updated_at = ? " +
+                "WHERE guild_id = ? AND user_id = ?", renamed)
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO members (user_name, updated_at, " +
+                "guild_id, user_id, role_ids) VALUES (?, ?, ?, ?, '')",
+                renamed)
+            self._connection.executemany(
+                "DELETE FROM members WHERE guild_id = ? AND user_id = ?",
+                removed)
+
+    def flush(self):
+        """Writes the buffered updates"""
+        self._write(self._take_pending())
+
+    async def flush_periodically(self, interval):
+        """
+        Writes the buffered updates every interval seconds, forever,
+        without blocking the event loop
+        """
+        logger = logging.getLogger("haruhichanbot")
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(interval)
+            pending = self._take_pending()
+            if not pending:
+                continue
+            try:
+                await loop.run_in_executor(None, self._write, pending)
+            except sqlite3.Error as e:
+                logger.error(f"Could not write the member snapshot: {e}")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
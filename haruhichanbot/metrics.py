@@ -0,0 +1,229 @@
+import asyncio
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds of the latency histograms buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10)
+
+
+def _format_labels(label_names, labels, extra=""):
+    pairs = ['{0}="{1}"'.format(name, str(value).replace('"', '\\"'))
+             for name, value in zip(label_names, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter():
+    def __init__(self, name, description, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self._values = dict()
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}",
+                 f"# TYPE {self.name} counter"]
+        # Copied as the values can be updated from the database threads
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in sorted(values):
+            lines.append("{0}{1} {2}".format(
+                self.name, _format_labels(self.label_names, labels), value))
+        return lines
+
+
+class Histogram():
+    def __init__(self, name, description, label_names=(),
+                 buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        # Labels -> [count per bucket (and +Inf), sum]
+        self._values = dict()
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [
+                    [0] * (len(self.buckets) + 1), 0]
+            counts[0][index] += 1
+            counts[1] += value
+
+    @contextmanager
+    def time(self, labels=()):
+        """Observes the duration of the with block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}",
+                 f"# TYPE {self.name} histogram"]
+        # Copied as the values can be updated from the database threads
+        with self._lock:
+            values = [(labels, (list(counts), total))
+                      for labels, (counts, total) in self._values.items()]
+        for labels, (counts, total) in sorted(values):
+            cumulated = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulated += count
+                lines.append("{0}_bucket{1} {2}".format(
+                    self.name,
+                    _format_labels(self.label_names, labels,
+                                   f'le="{bound}"'),
+                    cumulated))
+            label_str = _format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{label_str} {total}")
+            lines.append(f"{self.name}_count{label_str} {cumulated}")
+        return lines
+
+
+class Callback():
+    """
+    A metric whose value is read when rendered
+    func returns a number, or a dict of label values tuple -> number
+    """
+
+    def __init__(self, name, description, metric_type, func, label_names=()):
+        self.name = name
+        self.description = description
+        self.metric_type = metric_type
+        self.func = func
+        self.label_names = label_names
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}",
+                 f"# TYPE {self.name} {self.metric_type}"]
+        values = self.func()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in sorted(values.items()):
+            lines.append("{0}{1} {2}".format(
+                self.name, _format_labels(self.label_names, labels), value))
+        return lines
+
+
+class MetricsRegistry():
+    def __init__(self):
+        self._metrics = dict()
+
+    def _register(self, metric):
+        # Registering a metric again replaces it, e.g. for a new client
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, description, label_names=()):
+        return self._register(Counter(name, description, label_names))
+
+    def histogram(self, name, description, label_names=(),
+                  buckets=DEFAULT_BUCKETS):
+        return self._register(
+            Histogram(name, description, label_names, buckets))
+
+    def callback(self, name, description, metric_type, func,
+                 label_names=()):
+        return self._register(
+            Callback(name, description, metric_type, func, label_names))
+
+    def render(self):
+        """Returns every metric in the Prometheus text format"""
+        lines = list()
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logger = logging.getLogger("haruhichanbot")
+                logger.error(f"Could not render metric {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+commands_total = registry.counter(
+    "haruhichanbot_commands_total",
+    "Commands handled, by command", ("command",))
+command_seconds = registry.histogram(
+    "haruhichanbot_command_duration_seconds",
+    "Time to handle a command, by command", ("command",))
+db_query_seconds = registry.histogram(
+    "haruhichanbot_db_query_duration_seconds",
+    "Time spent running database functions, by function", ("query",))
+rest_call_seconds = registry.histogram(
+    "haruhichanbot_rest_call_duration_seconds",
+    "Time spent in Discord REST calls, by call", ("call",))
+event_loop_lag_seconds = registry.histogram(
+    "haruhichanbot_event_loop_lag_seconds",
+    "Delay of the event loop in running a scheduled callback")
+
+
+async def monitor_event_loop_lag(interval=1):
+    """Measures how late the event loop wakes up a sleeping task, forever"""
+    loop = asyncio.get_event_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        event_loop_lag_seconds.observe(max(0, loop.time() - start - interval))
+
+
+class MetricsServer():
+    """Minimal HTTP server answering GET /metrics with the registry"""
+
+    def __init__(self, host, port, metrics_registry=registry):
+        self.host = host
+        self.port = port
+        self.registry = metrics_registry
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle,
+                                                  self.host, self.port)
+        logger = logging.getLogger("haruhichanbot")
+        logger.info(f"Metrics available on http://{self.host}:{self.port}" +
+                    "/metrics")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            # Skips the headers
+            while (await reader.readline()).strip():
+                pass
+
+            parts = request_line.split()
+            if (len(parts) >= 2 and parts[0] == b"GET" and
+                    parts[1].split(b"?")[0] == b"/metrics"):
+                status = "200 OK"
+                body = self.registry.render().encode("utf-8")
+            else:
+                status = "404 Not Found"
+                body = b"Not found\n"
+            writer.write(
+                (f"HTTP/1.1 {status}\r\n" +
+                 "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n" +
+                 f"Content-Length: {len(body)}\r\n" +
+                 "Connection: close\r\n\r\n").encode("ascii") + body)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
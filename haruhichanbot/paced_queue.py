@@ -0,0 +1,60 @@
+import asyncio
+from collections import deque
+
+from .rate_limiter import RateLimiter
+
+
+class PacedQueue():
+    """
+    Items queued per target (a channel, a guild...) and processed by
+    one task per target, started when needed and ending once its queue
+    is empty
+    Calls are paced per target to stay under the rate limits
+    Subclasses implement _process_next()
+    """
+
+    def __init__(self, loop, rate, burst):
+        self.loop = loop
+        self._pacer = RateLimiter(rate, burst)
+        # Target ID -> pending items and task processing them
+        self._queues = dict()
+        self._workers = dict()
+
+    def _push(self, target, items):
+        """Queues items for target, without waiting"""
+        queue = self._queues.get(target.id)
+        if queue is None:
+            queue = self._queues[target.id] = deque()
+        queue.extend(items)
+        if target.id not in self._workers:
+            self._workers[target.id] = self.loop.create_task(
+                self._process_pending(target, queue))
+
+    @property
+    def depth(self):
+        """Number of items waiting, for every target"""
+        return sum(len(queue) for queue in self._queues.values())
+
+    def target_depth(self, target_id):
+        queue = self._queues.get(target_id)
+        return len(queue) if queue else 0
+
+    async def _pace(self, target_id):
+        """Waits until target_id is allowed a call, and counts it"""
+        delay = self._pacer.delay(target_id)
+        if delay:
+            await asyncio.sleep(delay)
+        self._pacer.consume(target_id)
+
+    async def _process_next(self, target, queue):
+        """Pops and processes the next items of queue, never empty"""
+        raise NotImplementedError
+
+    async def _process_pending(self, target, queue):
+        try:
+            while queue:
+                await self._process_next(target, queue)
+        finally:
+            # Nothing can be queued between the end of the loop and here
+            del self._workers[target.id]
+            del self._queues[target.id]
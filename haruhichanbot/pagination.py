@@ -0,0 +1,28 @@
+# Maximum length of a Discord message
+MESSAGE_MAX_LENGTH = 2000
+
+
+async def pack_lines(lines, header="", limit=MESSAGE_MAX_LENGTH):
+    """
+    Packs the lines of an async iterable in code block messages
+    of at most limit characters, the first one starting with header
+    Yields each message as soon as it is full, so that it can be sent
+    while the next lines are still being produced
+    """
+    block_start, block_end = "```", "\n```"
+    # Longest line that fits in a message on its own
+    max_line_length = limit - len(header) - len(block_start + block_end) - 1
+
+    chunk = list()
+    length = len(header + block_start + block_end)
+    async for line in lines:
+        line = line[:max_line_length]
+        if chunk and length + len(line) + 1 > limit:
+            yield header + block_start + "".join(chunk) + block_end
+            header = ""
+            chunk = list()
+            length = len(block_start + block_end)
+        chunk.append("\n" + line)
+        length += len(line) + 1
+    if chunk:
+        yield header + block_start + "".join(chunk) + block_end
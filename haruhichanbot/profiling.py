@@ -0,0 +1,130 @@
+import asyncio
+import contextvars
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+# Phase name -> seconds spent in it, for the command being handled
+current_timings = contextvars.ContextVar("current_timings", default=None)
+
+
+@contextmanager
+def phase(name):
+    """Adds the duration of the with block to the current command timings"""
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0) + time.perf_counter() - start
+
+
+class LoopWatchdog():
+    """
+    Thread checking that the event loop keeps running its callbacks
+    When the loop is blocked longer than threshold seconds, logs the stack
+    of the code blocking it
+    """
+
+    def __init__(self, loop, threshold, interval=0.1):
+        self.loop = loop
+        self.threshold = threshold
+        self.interval = interval
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = None
+        self._stopped = threading.Event()
+        self._beat_task = None
+
+    def start(self):
+        """Starts the watchdog, must be called from the event loop thread"""
+        self._loop_thread_id = threading.get_ident()
+        self._beat_task = self.loop.create_task(self._beat())
+        threading.Thread(target=self._watch, name="haruhichanbot-watchdog",
+                         daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._beat_task is not None:
+            self._beat_task.cancel()
+
+    async def _beat(self):
+        while not self._stopped.is_set():
+            self._heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        logger = logging.getLogger("haruhichanbot")
+        reported_heartbeat = None
+        while not self._stopped.wait(self.interval):
+            heartbeat = self._heartbeat
+            stall = time.monotonic() - heartbeat
+            # Reports each stall once
+            if stall < self.threshold or heartbeat == reported_heartbeat:
+                continue
+            reported_heartbeat = heartbeat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else ""
+            logger.warning(
+                f"Event loop blocked for more than {stall:.2f}s in:\n{stack}")
+
+
+class CommandProfiler():
+    """
+    Profiles the next commands with cProfile once enabled,
+    writing a .prof file and a text report per command
+    Only one command is profiled at a time, and other coroutines running
+    meanwhile on the event loop are included in its profile
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.remaining = 0
+        self._active = False
+
+    def enable(self, nb_commands):
+        self.remaining = nb_commands
+
+    @contextmanager
+    def profile(self, cmd_name):
+        if self.remaining <= 0 or self._active:
+            yield
+            return
+
+        # Only loaded when profiling is used
+        import cProfile
+
+        self.remaining -= 1
+        self._active = True
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            self._active = False
+            self._write_report(profiler, cmd_name)
+
+    def _write_report(self, profiler, cmd_name):
+        import io
+        import pstats
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, "{0}-{1}".format(
+            time.strftime("%Y%m%d-%H%M%S"), cmd_name))
+        profiler.dump_stats(path + ".prof")
+
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats(
+            "cumulative").print_stats(40)
+        with open(path + ".txt", "w") as f:
+            f.write(report.getvalue())
+
+        logger = logging.getLogger("haruhichanbot")
+        logger.info(f"Profile of {cmd_name} written to {path}.prof")
@@ -0,0 +1,71 @@
+import time
+
+
+class TokenBucket():
+    __slots__ = ("tokens", "updated_at")
+
+    def __init__(self, tokens, updated_at):
+        self.tokens = tokens
+        self.updated_at = updated_at
+
+
+class RateLimiter():
+    """
+    Token buckets of one scope (per user, per channel...), keyed by any
+    hashable value and created on first use
+    Each bucket holds at most burst tokens and gets rate tokens per second
+    """
+    # Seconds between two evictions of the idle buckets
+    eviction_interval = 60
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = dict()
+        self._last_eviction = time.monotonic()
+
+    def _refill(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.burst, now)
+        else:
+            bucket.tokens = min(self.burst, bucket.tokens +
+                                (now - bucket.updated_at) * self.rate)
+            bucket.updated_at = now
+        return bucket
+
+    def has_token(self, key, now=None):
+        """Returns whether key can be allowed now, without consuming"""
+        if now is None:
+            now = time.monotonic()
+        if now - self._last_eviction > self.eviction_interval:
+            self.evict_idle(now)
+        return self._refill(key, now).tokens >= 1
+
+    def consume(self, key, now=None):
+        """Consumes a token of key, even if its bucket is empty"""
+        if now is None:
+            now = time.monotonic()
+        self._refill(key, now).tokens -= 1
+
+    def delay(self, key, now=None):
+        """Returns the number of seconds before key has a token"""
+        if now is None:
+            now = time.monotonic()
+        missing = 1 - self._refill(key, now).tokens
+        return max(0, missing / self.rate)
+
+    def evict_idle(self, now=None):
+        """
+        Drops the buckets that have been refilled completely,
+        which behave exactly like new ones
+        """
+        if now is None:
+            now = time.monotonic()
+        full_after = self.burst / self.rate
+        self._buckets = {key: bucket for key, bucket in self._buckets.items()
+                         if now - bucket.updated_at < full_after}
+        self._last_eviction = now
+
+    def __len__(self):
+        return len(self._buckets)
@@ -0,0 +1,69 @@
+import logging
+
+import discord
+
+from . import metrics
+from .paced_queue import PacedQueue
+
+
+class RoleBatchJob():
+    """A role added to or removed from many members"""
+
+    def __init__(self, role, add, members, on_done=None):
+        self.role = role
+        self.add = add
+        self.remaining = len(members)
+        self.members = members
+        self.nb_changed = 0
+        self.nb_skipped = 0
+        self.nb_failed = 0
+        self.on_done = on_done
+
+
+class RoleBatchQueue(PacedQueue):
+    """
+    Member role changes of the batch jobs, queued per guild
+    and applied by one task per guild, paced to stay under
+    the rate limits of the member edits
+    Items are (job, member) pairs
+    """
+
+    def submit(self, guild, job):
+        """Queues the changes of job, on_done(job) is called once applied"""
+        if not job.members:
+            if job.on_done is not None:
+                job.on_done(job)
+            return
+        # The members are only needed until they are queued
+        members, job.members = job.members, None
+        self._push(guild, [(job, member) for member in members])
+
+    async def _apply(self, job, member, guild_id):
+        has_role = job.role in member.roles
+        if has_role == job.add:
+            job.nb_skipped += 1
+            return
+
+        await self._pace(guild_id)
+        try:
+            if job.add:
+                with metrics.rest_call_seconds.time(("add_roles",)):
+                    await member.add_roles(job.role)
+            else:
+                with metrics.rest_call_seconds.time(("remove_roles",)):
+                    await member.remove_roles(job.role)
+            job.nb_changed += 1
+        except discord.HTTPException as e:
+            job.nb_failed += 1
+            logger = logging.getLogger("haruhichanbot")
+            logger.error(f"Could not change role {job.role.id} " +
+                         f"of member {member.id}: {e}")
+
+    async def _process_next(self, guild, queue):
+        job, member = queue.popleft()
+        try:
+            await self._apply(job, member, guild.id)
+        finally:
+            job.remaining -= 1
+            if not job.remaining and job.on_done is not None:
+                job.on_done(job)
@@ -0,0 +1,59 @@
+import logging
+
+from . import exceptions
+
+
+class RoleCache():
+    """
+    Discord Role objects of the assignable roles,
+    keyed by (guild ID, role name) and kept up to date by the role events
+    """
+
+    def __init__(self, roles_cfg):
+        self.set_roles_config(roles_cfg)
+
+    def set_roles_config(self, roles_cfg):
+        """Uses new role settings, dropping every cached role"""
+        # Role name -> role ID and role ID -> role names
+        self._role_ids = dict()
+        self._role_names = dict()
+        for role_name, role_desc in roles_cfg.items():
+            self._role_ids[role_name] = role_desc["id"]
+            self._role_names.setdefault(role_desc["id"], []).append(role_name)
+        self._roles = dict()
+
+    def populate(self, guild):
+        """Caches every assignable role that exists in guild"""
+        for role_name, role_id in self._role_ids.items():
+            role = guild.get_role(role_id)
+            if role is not None:
+                self._roles[(guild.id, role_name)] = role
+
+    def get(self, guild, role_name):
+        """
+        Returns the Discord Role object from the guild and the role's name
+        Raises exceptions.InvalidRoleException if the role isn't in guild
+        """
+        role = self._roles.get((guild.id, role_name))
+        if role is None:
+            role = guild.get_role(self._role_ids[role_name])
+            if role is None:
+                logger = logging.getLogger("haruhichanbot")
+                logger.error(
+                    f"An invalid role {role_name} is in " +
+                    f"the commands settings file for guild {guild.id}.")
+                raise exceptions.InvalidRoleException(role_name)
+            self._roles[(guild.id, role_name)] = role
+        return role
+
+    def update_role(self, role):
+        for role_name in self._role_names.get(role.id, ()):
+            self._roles[(role.guild.id, role_name)] = role
+
+    def remove_role(self, role):
+        for role_name in self._role_names.get(role.id, ()):
+            self._roles.pop((role.guild.id, role_name), None)
+
+    def remove_guild(self, guild):
+        for role_name in self._role_ids:
+            self._roles.pop((guild.id, role_name), None)
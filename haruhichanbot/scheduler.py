@@ -0,0 +1,90 @@
+import asyncio
+import logging
+
+
+class CommandScheduler():
+    """
+    Runs command handlers as tasks, at most max_concurrency at a time
+    The commands of a user run one after the other, in the order
+    they were received, so that e.g. a register followed by a remove
+    always apply in that order
+    """
+
+    def __init__(self, loop, max_concurrency):
+        self.loop = loop
+        self.queued = 0
+        self.in_flight = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # User ID -> [lock, number of commands queued or running]
+        self._user_locks = dict()
+        # User ID -> tasks of the commands queued or running
+        self._user_tasks = dict()
+
+    def submit(self, user_id, coro, timeout=None, on_timeout=None):
+        """
+        Schedules coro after the previous commands of user_id
+        It is cancelled if it runs longer than timeout seconds,
+        on_timeout() is then called
+        Returns the task running it
+        """
+        user_lock = self._user_locks.get(user_id)
+        if user_lock is None:
+            user_lock = self._user_locks[user_id] = [asyncio.Lock(), 0]
+        user_lock[1] += 1
+        self.queued += 1
+
+        task = self.loop.create_task(
+            self._run(user_id, user_lock, coro, timeout, on_timeout))
+        self._user_tasks.setdefault(user_id, set()).add(task)
+        task.add_done_callback(
+            lambda task: self._forget_task(user_id, task))
+        return task
+
+    async def _run(self, user_id, user_lock, coro, timeout, on_timeout):
+        started = False
+        try:
+            # Waiting for the user's previous commands first
+            # leaves the global slots to the other users meanwhile
+            async with user_lock[0], self._semaphore:
+                self.queued -= 1
+                self.in_flight += 1
+                started = True
+                try:
+                    return await asyncio.wait_for(coro, timeout)
+                except asyncio.TimeoutError:
+                    logger = logging.getLogger("haruhichanbot")
+                    logger.warning(f"A command of {user_id} was cancelled " +
+                                   f"after {timeout}s")
+                    if on_timeout is not None:
+                        on_timeout()
+        finally:
+            if started:
+                self.in_flight -= 1
+            else:
+                self.queued -= 1
+                # Cancelled before starting, never awaited otherwise
+                coro.close()
+            user_lock[1] -= 1
+            if not user_lock[1]:
+                del self._user_locks[user_id]
+
+    def _forget_task(self, user_id, task):
+        tasks = self._user_tasks[user_id]
+        tasks.discard(task)
+        if not tasks:
+            del self._user_tasks[user_id]
+        if not task.cancelled() and task.exception() is not None:
+            logger = logging.getLogger("haruhichanbot")
+            logger.error(f"Exception in a command of {user_id}",
+                         exc_info=task.exception())
+
+    def cancel(self, user_id):
+        """Cancels the commands of a user, returns how many were cancelled"""
+        tasks = self._user_tasks.get(user_id, ())
+        for task in tasks:
+            task.cancel()
+        return len(tasks)
+
+    def cancel_all(self):
+        for user_id in list(self._user_tasks):
+            self.cancel(user_id)
@@ -0,0 +1,42 @@
+import logging
+
+import discord
+
+from . import metrics
+from .paced_queue import PacedQueue
+from .pagination import MESSAGE_MAX_LENGTH
+
+
+class SendQueue(PacedQueue):
+    """
+    Outbound messages, queued per channel and sent by one task per channel
+    Pending messages of a channel are coalesced when they fit in one,
+    and sends are paced per channel to stay under the rate limits
+    """
+
+    def enqueue(self, channel, content):
+        """Queues content to be sent in channel, without waiting"""
+        self._push(channel, (content,))
+
+    def channel_depth(self, channel_id):
+        return self.target_depth(channel_id)
+
+    def _coalesce(self, queue):
+        """Pops the next message, merged with the following ones that fit"""
+        content = queue.popleft()
+        while (queue and len(content) + 1 + len(queue[0]) <=
+               MESSAGE_MAX_LENGTH):
+            content += "\n" + queue.popleft()
+        return content
+
+    async def _process_next(self, channel, queue):
+        # Messages queued while waiting are coalesced with the next one
+        await self._pace(channel.id)
+        content = self._coalesce(queue)
+        try:
+            with metrics.rest_call_seconds.time(("send_message",)):
+                await channel.send(content)
+        except discord.HTTPException as e:
+            logger = logging.getLogger("haruhichanbot")
+            logger.error(
+                f"Could not send message in channel {channel.id}: {e}")
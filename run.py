@@ -1,8 +1,12 @@
 import logging
+import time
 
-import argparse
+# Taken before the project imports so that --measure-startup times them
+start = time.perf_counter()
 
-from haruhichanbot import HaruhiChanBot
+import argparse  # noqa: E402
+
+from haruhichanbot.config import Config  # noqa: E402
 
 
 def init_loggers():
@@ -24,14 +28,112 @@ def parse_args():
     parser.add_argument("--config", dest="cfg_file",
                         default=None,
                         help="path to the configuration file to use")
+    parser.add_argument("--migrate", action="store_true",
+                        help="update the database schema and exit")
+    parser.add_argument("--backfill-guild", type=int, default=None,
+                        metavar="GUILD_ID",
+                        help="move the accounts registered before they " +
+                        "were scoped by server to this server and exit")
+    parser.add_argument("--backfill-guilds-from-snapshot",
+                        action="store_true",
+                        help="copy the accounts registered before they " +
+                        "were scoped by server in each server their user " +
+                        "was seen in by the member snapshot and exit")
+    parser.add_argument("--shard-count", type=int, default=None,
+                        help="total number of shards " +
+                        "(overrides the configuration file)")
+    parser.add_argument("--shard-ids", default=None,
+                        help="comma-separated shard IDs run by this process")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of processes the shards are spread " +
+                        "over (overrides the configuration file)")
+    parser.add_argument("--measure-startup", action="store_true",
+                        help="log the time taken to be ready and exit")
     args = parser.parse_args()
+    if args.shard_ids:
+        args.shard_ids = [int(x) for x in args.shard_ids.split(",")]
+        if not args.shard_count:
+            parser.error("--shard-ids requires --shard-count")
     return args
 
 
+def backfill_guilds(args, config):
+    """Scopes by server the accounts registered before it was required"""
+    from haruhichanbot import db_manager
+
+    logger = logging.getLogger("haruhichanbot")
+    db_manager.init_session(config)
+    if args.backfill_guild:
+        nb_moved = db_manager.backfill_guild_id(str(args.backfill_guild))
+        logger.info(f"{nb_moved} account(s) moved to {args.backfill_guild}")
+        return
+
+    from haruhichanbot.member_snapshot import MemberSnapshot
+
+    if not config.member_snapshot_file:
+        raise SystemExit("No member snapshot file in the configuration")
+    snapshot = MemberSnapshot(config.member_snapshot_file)
+    nb_copied, nb_unscoped = db_manager.backfill_guild_ids(
+        snapshot.guild_ids_by_user())
+    snapshot.close()
+    logger.info(f"{nb_copied} account(s) copied in the servers of " +
+                f"their users, {nb_unscoped} account(s) of users " +
+                "never seen are left unscoped")
+
+
+def measure_startup(bot, start, imported, created):
+    """Logs the duration of each startup step once bot is ready and stops it"""
+    async def wait_until_ready():
+        await bot.wait_until_ready()
+        ready = time.perf_counter()
+        await bot.db_connect_task
+        db_ready = time.perf_counter()
+
+        logger = logging.getLogger("haruhichanbot")
+        logger.info(
+            "Startup: imports {0:.2f}s, client creation {1:.2f}s, ".format(
+                imported - start, created - imported) +
+            "ready after {0:.2f}s, database after {1:.2f}s".format(
+                ready - start, db_ready - start))
+        await bot.close()
+
+    bot.loop.create_task(wait_until_ready())
+
+
 def main():
     init_loggers()
     args = parse_args()
-    bot = HaruhiChanBot(args.cfg_file)
+    # The modules are imported by the mode using them, e.g. migrating
+    # the database or supervising workers doesn't load discord.py
+    if args.migrate:
+        from haruhichanbot import db_manager
+
+        db_manager.init_session(Config(args.cfg_file))
+        db_manager.migrate()
+        return
+
+    config = Config(args.cfg_file)
+    if args.backfill_guild or args.backfill_guilds_from_snapshot:
+        backfill_guilds(args, config)
+        return
+    shard_count = args.shard_count or config.shard_count
+    workers = args.workers or config.workers
+    if workers > 1 and not args.shard_ids and not args.measure_startup:
+        from haruhichanbot.launcher import ShardLauncher
+
+        if not shard_count:
+            raise SystemExit("Using several workers requires a shard count")
+        ShardLauncher(args.cfg_file, shard_count, workers,
+                      worker_init=init_loggers).run()
+        return
+
+    from haruhichanbot import HaruhiChanBot
+
+    imported = time.perf_counter()
+    bot = HaruhiChanBot(args.cfg_file, shard_ids=args.shard_ids,
+                        shard_count=shard_count)
+    if args.measure_startup:
+        measure_startup(bot, start, imported, time.perf_counter())
     bot.run()
 
 
@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from haruhichanbot import async_db  # noqa: E402
+from haruhichanbot import db_manager  # noqa: E402
+from haruhichanbot import exceptions  # noqa: E402
+from haruhichanbot.config import Config  # noqa: E402
+
+GUILD_ID = 123456789012345678
+NB_USERS = 100
+NB_ACCOUNTS = 4
+
+
+@pytest.fixture(params=[False, True], ids=["no_cache", "cache"])
+def sqlite_db(request, tmp_path):
+    """A SQLite database used through the default database thread pool"""
+    config_file = tmp_path / "config.ini"
+    config_file.write_text(
+        "[Credentials]\n"
+        "BotToken = token\n"
+        f"SqlDatabase = {tmp_path / 'accounts.db'}\n"
+        "SqlDbApi = sqlite\n"
+        "[Chat]\n"
+        "CommandPrefix = !\n"
+        "[Cache]\n"
+        f"AccountsCacheEnabled = {'yes' if request.param else 'no'}\n")
+    db_manager.accounts_cache = None
+    async_db.init(Config(str(config_file)))
+    db_manager.migrate()
+    yield
+    async_db.executor.shutdown()
+    db_manager.engine.dispose()
+    db_manager.accounts_cache = None
+
+
+def register(user_id, account_name, account_server="server"):
+    return async_db.insert_user_account(
+        discord_guild_id=GUILD_ID, discord_user_id=user_id,
+        account_source="Source", account_server=account_server,
+        account_name=account_name)
+
+
+async def use_accounts(user_id):
+    """Registers, lists and removes accounts like a user would"""
+    for i in range(NB_ACCOUNTS):
+        await register(user_id, f"name{i}")
+    with pytest.raises(exceptions.DuplicateDbEntryWarning):
+        await register(user_id, "name0")
+
+    accounts = await async_db.get_accounts_for_user(GUILD_ID, user_id)
+    assert [account[2] for account in accounts] == [
+        f"name{i}" for i in range(NB_ACCOUNTS)]
+    await async_db.count_accounts_for_source_and_server(
+        discord_guild_id=GUILD_ID, account_source="Source")
+
+    # Odd users remove one of their accounts
+    if user_id % 2:
+        assert await async_db.remove_account(
+            discord_guild_id=GUILD_ID, discord_user_id=user_id,
+            account_source="Source", account_server="server",
+            account_name="name0") == 1
+        accounts = await async_db.get_accounts_for_user(GUILD_ID, user_id)
+        assert len(accounts) == NB_ACCOUNTS - 1
+
+
+def test_concurrent_register_list_remove(sqlite_db):
+    async def run_users():
+        await asyncio.gather(*(use_accounts(user_id)
+                               for user_id in range(NB_USERS)))
+        return (
+            await async_db.count_accounts_for_source_and_server(
+                discord_guild_id=GUILD_ID, account_source="Source"),
+            await async_db.get_accounts_for_source_and_server(
+                discord_guild_id=GUILD_ID, account_source="Source"))
+
+    nb_accounts, accounts = asyncio.run(run_users())
+    expected = NB_USERS * NB_ACCOUNTS - NB_USERS // 2
+    assert nb_accounts == expected
+    assert len(accounts) == expected
+    assert len(set(accounts)) == expected
+
+
+@pytest.mark.parametrize("account_server", ["server", None])
+def test_concurrent_duplicates_insert_once(sqlite_db, account_server):
+    async def register_all():
+        return await asyncio.gather(
+            *(register(1, "name", account_server) for _ in range(50)),
+            return_exceptions=True)
+
+    results = asyncio.run(register_all())
+    assert results.count(None) == 1
+    assert all(isinstance(result, exceptions.DuplicateDbEntryWarning)
+               for result in results if result is not None)
+    assert len(db_manager.get_accounts_for_user(GUILD_ID, 1)) == 1
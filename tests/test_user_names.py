@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("discord")
+pytest.importorskip("sqlalchemy")
+
+from haruhichanbot import HaruhiChanBot  # noqa: E402
+
+REST_LATENCY = 0.05
+
+
+class FakeUser():
+    def __init__(self, user_id):
+        self.id = user_id
+
+    def __str__(self):
+        return f"user{self.id}#0001"
+
+
+class FakeGuild():
+    id = 1
+
+    def get_member(self, user_id):
+        return None
+
+
+@pytest.fixture
+def bot(tmp_path):
+    """A HaruhiChanBot whose fetch_user is a counted fake REST call"""
+    config_file = tmp_path / "config.ini"
+    config_file.write_text(
+        "[Credentials]\n"
+        "BotToken = token\n"
+        f"SqlDatabase = {tmp_path / 'accounts.db'}\n"
+        "SqlDbApi = sqlite\n"
+        "[Chat]\n"
+        "CommandPrefix = !\n"
+        "[Cache]\n"
+        "MemberSnapshotFile =\n"
+        "FetchUserConcurrency = 10\n")
+    cmd_cfg_file = tmp_path / "commands_settings.json"
+    cmd_cfg_file.write_text(json.dumps({"account_sources": {}, "roles": {}}))
+    bot = HaruhiChanBot(str(config_file), str(cmd_cfg_file))
+
+    bot.fetched_ids = list()
+
+    async def fetch_user(user_id):
+        bot.fetched_ids.append(user_id)
+        await asyncio.sleep(REST_LATENCY)
+        return FakeUser(user_id)
+
+    bot.fetch_user = fetch_user
+    # Odd users are in the gateway cache
+    bot.get_user = lambda user_id: FakeUser(user_id) if user_id % 2 else None
+    return bot
+
+
+def test_fetches_only_uncached_users_concurrently(bot):
+    user_ids = list(range(100))
+    start = bot.loop.time()
+    user_names = bot.loop.run_until_complete(
+        bot.get_user_names(FakeGuild(), user_ids))
+    duration = bot.loop.time() - start
+
+    assert user_names == {user_id: f"user{user_id}#0001"
+                          for user_id in user_ids}
+    assert sorted(bot.fetched_ids) == list(range(0, 100, 2))
+    # 50 fetches, 10 at a time
+    assert duration < 10 * REST_LATENCY
+
+    bot.loop.run_until_complete(bot.get_user_names(FakeGuild(), user_ids))
+    assert len(bot.fetched_ids) == 50
+
+
+def test_concurrent_listings_share_fetches(bot):
+    user_ids = list(range(0, 100, 2))
+
+    async def list_concurrently():
+        return await asyncio.gather(
+            *(bot.get_user_names(FakeGuild(), user_ids) for _ in range(10)))
+
+    results = bot.loop.run_until_complete(list_concurrently())
+    assert sorted(bot.fetched_ids) == user_ids
+    assert all(len(user_names) == len(user_ids) for user_names in results)
+    assert not bot.user_fetches
+
+
+def test_cancelled_listing_keeps_shared_fetches(bot):
+    async def cancel_one_listing():
+        first = bot.loop.create_task(bot.get_user_names(FakeGuild(), [2]))
+        second = bot.loop.create_task(bot.get_user_names(FakeGuild(), [2]))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert bot.loop.run_until_complete(cancel_one_listing()) == {
+        2: "user2#0001"}
+    assert bot.fetched_ids == [2]